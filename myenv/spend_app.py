@@ -2,16 +2,33 @@ import streamlit as st
 st.set_page_config(page_icon="💲",page_title="SpendApp - USAspending Explorer",layout="wide") # Increase page width for app
 import pandas as pd
 import numpy as np
-import asyncio
-import aiohttp
-import sys
-import requests
-import openpyxl
-import plotly as plt
 import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import time
+import os
+import json
+import spend_cache
+import spend_catalog
+import spend_client
+import spend_figures
+import spend_metrics
+import spend_pbdb
+import spend_shared
+
+
+CATALOG_PATH = spend_catalog.CATALOG_PATH # Agency catalog bundled with the app
+DEBUG = os.environ.get('SPENDAPP_DEBUG') == '1' # Always show the debug panel
+REDRAW_SECONDS = 0.3 # Shortest gap between redraws of a chart while its years are still arriving
+
+cache_resource = getattr(st, 'cache_resource', None) or (lambda **kwargs: st.cache(allow_output_mutation=True, **kwargs)) # st.cache was replaced by st.cache_resource in later Streamlit releases
+
+# Columns kept from each kind of response: raw field -> (column name, dtype). Everything else is dropped when the frame is built
+SCHEMAS = {
+    'historical': {'fiscal_year': ('Fiscal Year', 'int16'), 'toptier_code': ('toptier_code', 'category'), 'obligations': ('Spending', 'float64')},
+    'category': {'fiscal_year': ('Fiscal Year', 'int16'), 'name': ('Subagency', 'category'), 'total_obligations': ('Spending', 'float64')},
+    'children': {'fiscal_year': ('Fiscal Year', 'int16'), 'subagency': ('Subagency', 'category'), 'name': ('Component', 'category'), 'total_obligations': ('Spending', 'float64')},
+    'breakdown': {'name': ('Breakdown', 'category'), 'obligated_amount': ('Spending', 'float64')},
+    'trend': {'fiscal_year': ('Fiscal Year', 'int16'), 'name': ('Breakdown', 'category'), 'obligated_amount': ('Spending', 'float64')},
+}
 
 
 #### Functions
@@ -30,102 +47,580 @@ def human_format(num):
     return '{}{}'.format('{:f}'.format(num).rstrip('0').rstrip('.'),
                          ['', 'K', 'M', 'B', 'T'][magnitude])
 
-@st.cache(show_spinner=False)
+@spend_metrics.cache_counter('CGAC_list')
 def CGAC_list():
     """
-    This function imports the index of government agencies and corresponding Common Government Accounting Codes (CGAC) as a dataframe. Another script (Clean_CGAC.py) downloads the raw table of data and cleans it. The cleaned file is stored in the Github repository for this project, and this function loads the data from the raw Github link.
-    Input: Github link (string)
-    Output: Dataframe of agencies and CGAC codes (pd.Dataframe)
-    """
-    url = 'https://github.com/abdelkaderalia/SpendApp/raw/main/Clean_Data/CGAC_list.xlsx'
-    r = requests.get(url)
-    data = r.content
-    df = pd.read_excel(data)
-    s = pd.Series(df['CGAC'])
-    df['CGAC']=pd.to_numeric(df['CGAC'],errors='coerce')
-    df = df.fillna(0)
-    df['CGAC']=df['CGAC'].apply(np.int64)
-    df['CGAC']=df['CGAC'].astype(str)
-    df['CGAC'] = np.where(df['CGAC'].apply(len)<3, df['CGAC'].str.zfill(3), df['CGAC'])
-    df = df.iloc[1: , :]
-    new_row = pd.DataFrame({'CGAC':' ', 'AGENCY NAME':' ','OTHER NAME':' ','Link':' ','Description':' ','Website':' '},index =[0])
-    df = pd.concat([new_row, df]).reset_index(drop = True)
+    This function loads the index of government agencies and corresponding Common Government Accounting Codes (CGAC) as a dataframe. Another script (Clean_CGAC.py) downloads the raw table of data and cleans it, and Build_Catalog.py converts it to the JSON catalog that ships with the app. The first worker process to load it publishes it to spend_shared, and the others map that copy.
+    Input: None
+    Output: Dataframe of agencies and CGAC codes, with a blank first row (pd.Dataframe, read-only)
+    """
+    df = spend_shared.read('catalog',since=os.path.getmtime(CATALOG_PATH)) # Republished when the catalog file changes
+    if df is None:
+        spend_metrics.mark_miss()
+        with open(CATALOG_PATH) as f:
+            records = json.load(f)
+        new_row = {'CGAC':' ', 'AGENCY NAME':' ','OTHER NAME':' ','Link':' ','Description':' ','Website':' '} # Blank row, so the dropdown defaults to blank
+        df = spend_shared.publish('catalog',pd.DataFrame.from_records([new_row] + records))
     return df
 
 
-async def process_year(session,year,toptier_code,type):
-    url = 'https://api.usaspending.gov'
-    payload = {"fiscal_year":year}
+@spend_metrics.cache_counter('agency_index')
+@cache_resource(show_spinner=False)
+def agency_index():
+    """
+    This function indexes the agency catalog by agency name, so looking up an agency's code, website and description doesn't scan the whole table.
+    Input: None
+    Output: Agency record by agency name (dict)
+    """
+    spend_metrics.mark_miss()
+    return {record['AGENCY NAME']: record for record in CGAC_list().to_dict('records')}
 
-    if type == 'historical':
-        endpoint=f'/api/v2/agency/{toptier_code}/awards/'
-        async with session.get(f'{url}{endpoint}',params=payload) as resp:
-            data = await resp.json()
-            df = pd.DataFrame(data.items()).transpose() # Convert to df and transpose
-            df.columns = df.iloc[0] # Reset column names using first row
-            df = df.tail(df.shape[0]-1) # Remove first row
 
-    elif type == 'category':
-        endpoint=f'/api/v2/agency/{toptier_code}/sub_agency/'
-        async with session.get(f'{url}{endpoint}',params=payload) as resp:
-            data = await resp.json()
-            df = pd.DataFrame(data['results'])
-            df.insert(loc = 0,column = 'fiscal_year',value = year)
+async def process_year(year,toptier_code,type):
+    """
+    This function pulls one fiscal year of award data for an agency through the shared API client.
+    Input: year (int), CGAC code (string), type of data (string, 'historical', 'category' or 'children')
+    Output: Raw JSON records for the year (list of dicts), or None if the request failed
+    """
+    with spend_metrics.timer('process_year',toptier_code=toptier_code,fiscal_year=year,type=type):
+        if type == 'historical':
+            data = await spend_client.fetch('awards',toptier_code,year)
+            if data is None: # Request failed after retries
+                return None
+            records = [dict(data,toptier_code=toptier_code)] # The awards endpoint returns a single record per year
 
-    return df
+        elif type == 'category':
+            data = await spend_client.fetch('sub_agency',toptier_code,year)
+            if data is None: # Request failed after retries
+                return None
+            records = [dict(item,fiscal_year=year) for item in data['results']] # Tag each subagency with the year
+
+        elif type == 'children':
+            data = await spend_client.fetch('sub_agency',toptier_code,year) # Same response as 'category', so this is usually a cache read
+            if data is None: # Request failed after retries
+                return None
+            records = [dict(child,fiscal_year=year,subagency=item['name']) for item in data['results'] for child in (item.get('children') or [])] # Flatten each subagency's components
+
+        return records
+
+
+def build_frame(records,type):
+    """
+    This function assembles raw JSON records into the results dataframe in a single columnar construction, keeping only the columns in SCHEMAS and converting them to compact types on the way in.
+    Input: records (list of dicts), type of data (string, 'historical', 'category', 'children', 'breakdown' or 'trend')
+    Output: Dataframe of results, sorted by fiscal year where it has one (pd.Dataframe)
+    """
+    schema = SCHEMAS[type]
+    full = pd.DataFrame.from_records(records,columns=list(schema)) # Unused fields such as messages and nested children are never copied
+    amounts = [field for field, (column, dtype) in schema.items() if dtype == 'float64']
+    full[amounts] = full[amounts].apply(pd.to_numeric,errors='coerce') # Store amounts as numbers; missing amounts become NaN
+    full = full.astype({field: dtype for field, (column, dtype) in schema.items()}).rename(columns={field: column for field, (column, dtype) in schema.items()})
+    if 'Fiscal Year' in full:
+        full = full.sort_values('Fiscal Year',kind='stable',ignore_index=True) # Years arrive in any order when streamed
+    return full
 
 
 async def async_func(toptier_code,type):
-    async with aiohttp.ClientSession() as session:
-        arr = []
+    """
+    This function pulls award data for an agency for every fiscal year from 2008 to the latest one with published data, requesting all years concurrently. Run it with spend_client.run().
+    Input: CGAC code (string), type of data (string, 'historical', 'category' or 'children')
+    Output: Dataframe of results (pd.Dataframe)
+    """
+    return await async_func_many([toptier_code],type)
+
+
+async def async_func_many(toptier_codes,type):
+    """
+    This function pulls award data for several agencies for every fiscal year from 2008 to the latest one with published data, sending every agency and year request in one concurrent batch. Run it with spend_client.run().
+    Input: CGAC codes (list of strings), type of data (string, 'historical', 'category' or 'children')
+    Output: Dataframe of results for all agencies in long format (pd.Dataframe)
+    """
+    return (await fetch_frame(toptier_codes,type))[0]
 
-        for year in range(2008,2023):
-            df = process_year(session,year,toptier_code,type)
-            arr.append(df)
 
-        results = await asyncio.gather(*arr)
+async def fetch_frame(toptier_codes,type):
+    """
+    This function does the work behind async_func_many, and also reports which years failed so callers can decide whether the results are complete. Run it with spend_client.run().
+    Input: CGAC codes (list of strings), type of data (string, 'historical', 'category' or 'children')
+    Output: Dataframe of results for all agencies in long format (pd.Dataframe), (CGAC code, fiscal year) pairs that failed (list)
+    """
+    arr = []
+    jobs = []
+    years = await spend_client.fiscal_years() # Discovered, so new years appear on their own
 
-        if type == 'historical':
-            full = pd.DataFrame(columns=['fiscal_year','toptier_code','transaction_count','obligations','messages','latest_action_date'])
-            for item in results:
-                full = full.append(item)
+    for toptier_code in toptier_codes:
+        for year in years:
+            records = process_year(year,toptier_code,type)
+            arr.append(records)
+            jobs.append((toptier_code,year))
 
-            full['fiscal_year']=full['fiscal_year'].astype(str) # Redefine year as string
-            full = full.rename(columns={"fiscal_year":"Fiscal Year","obligations":"Spending"}) # Change column names
-            full = full.reset_index(drop=True)
+    with spend_metrics.timer('async_func',toptier_codes=list(toptier_codes),type=type):
+        results = await spend_client.gather(arr) # Years that fail or time out come back as None
+    records = [record for item in results if item is not None for record in item] # Flatten into one list of records
+    failed = sorted(job for job, item in zip(jobs,results) if item is None)
+
+    with spend_metrics.timer('build_frame',type=type,rows=len(records)):
+        return build_frame(records,type), failed
 
-        elif type == 'category':
-            full = pd.DataFrame(columns=['fiscal_year','name','abbreviation','total_obligations','transaction_count','new_award_count','children'])
-            for item in results:
-                full = full.append(item)
 
-            full = full.rename(columns={"name": "Subagency","fiscal_year":"Fiscal Year","total_obligations":"Spending"}) # Rename columns
-            full['Fiscal Year']=full['Fiscal Year'].astype(str) # Redefine year as string
-            full = full.reset_index(drop=True)
+def stream_frame(toptier_codes,type,draw):
+    """
+    This function pulls award data like async_func_many, but hands the partial results to draw as fiscal years arrive, with a progress bar, so one slow year doesn't hold up the whole chart. Years that fail or time out are left out and reported instead of failing the view.
+    Input: CGAC codes (list of strings), type of data (string, 'historical', 'category' or 'children'), draw (function taking the partial dataframe)
+    Output: Dataframe of results (pd.Dataframe), (CGAC code, fiscal year) pairs that failed (list)
+    """
+    jobs = [(toptier_code,year) for toptier_code in toptier_codes for year in spend_client.run(spend_client.fiscal_years())]
+    progress = st.progress(0)
+    records = []
+    failed = []
+    drawn = time.perf_counter()
+    for done, (position, result) in enumerate(spend_client.stream([process_year(year,toptier_code,type) for toptier_code, year in jobs]), 1):
+        if result is None: # Failed or ran out of time
+            failed.append(jobs[position])
+        else:
+            records.extend(result)
+        progress.progress(done / len(jobs))
+        if records and done < len(jobs) and time.perf_counter() - drawn > REDRAW_SECONDS: # Redraw with what has arrived so far
+            draw(build_frame(records,type))
+            drawn = time.perf_counter()
+    progress.empty()
+    return build_frame(records,type), sorted(failed)
+
+
+def shared_frame(name,toptier_codes,type):
+    """
+    This function returns a frame from spend_shared, or pulls it with fetch_frame and publishes it there, so every session and worker process on the host maps one copy of an agency's data. Copies older than the agencies' last refresh or the open fiscal year's time to live are rebuilt. Results with failed years aren't published, so the next rerun tries those years again.
+    Input: name (string), CGAC codes the frame is built from (list of strings), type of data (string)
+    Output: Dataframe of results (pd.Dataframe, read-only if published), (CGAC code, fiscal year) pairs that failed (list)
+    """
+    df = spend_shared.read(name,since=spend_client.changed(*toptier_codes),max_age=spend_cache.OPEN_YEAR_TTL)
+    if df is not None:
+        return df, []
+    df, failed = spend_client.run(fetch_frame(toptier_codes,type))
+    if not failed:
+        df = spend_shared.publish(name,df)
+    return df, failed
+
+
+def load_progressively(name,toptier_codes,type,chart,figure):
+    """
+    This function returns a chart's data like shared_frame, but when the data has to be pulled it streams it in with stream_frame while redrawing the chart. Results with failed years aren't published, so the next rerun tries those years again.
+    Input: name (string, shared frame name), CGAC codes (list of strings), type of data (string), chart (st.empty placeholder), figure (function building a go.Figure from a partial dataframe)
+    Output: Dataframe of results (pd.Dataframe), (CGAC code, fiscal year) pairs that failed (list)
+    """
+    df = spend_shared.read(name,since=spend_client.changed(*toptier_codes),max_age=spend_cache.OPEN_YEAR_TTL)
+    if df is not None:
+        return df, []
+    df, failed = stream_frame(toptier_codes,type,lambda partial: chart.plotly_chart(figure(partial), use_container_width=True))
+    if not failed:
+        df = spend_shared.publish(name,df)
+    return df, failed
 
-        return full
+
+def failed_note(failed,names):
+    """
+    This function describes which fiscal years are missing from a chart because their requests failed. Build_Reports.py puts the same note on its charts.
+    Input: failed ((CGAC code, fiscal year) pairs from stream_frame or fetch_frame), names (dict, agency name by CGAC code)
+    Output: Note (string)
+    """
+    missing = ', '.join(f'{names[code]} {year}' if len(names) > 1 else str(year) for code, year in failed)
+    return f'Some fiscal years could not be loaded and are missing from this chart: {missing}.'
+
+
+def failed_caption(failed,names):
+    """
+    This function notes which fiscal years are missing from a chart because their requests failed.
+    Input: failed ((CGAC code, fiscal year) pairs from stream_frame), names (dict, agency name by CGAC code)
+    Output: None
+    """
+    if len(failed) > 0:
+        st.caption(f'*{failed_note(failed,names)} They will be retried on the next update.')
 
 
-@st.cache(show_spinner=False) # Use caching to improve speed and performance
-def breakdown_by(toptier_code,year,breakdown):
+def breakdown_frame(data):
     """
-    This function calls on the USASpending API to pull 2021 award data broken down by budget function or object class, depending on the user's input.
+    This function converts a budget function or object class response into the breakdown dataframe.
+    Input: data (dict, parsed JSON response)
+    Output: Dataframe of results (pd.Dataframe)
+    """
+    return build_frame(data['results'],'breakdown')
+
+
+async def fetch_breakdown(toptier_code,year,breakdown):
+    """
+    This function pulls award data for one fiscal year broken down by budget function or object class. Run it with spend_client.run(), or use breakdown_by.
+    Input: CGAC code (string), year (int), breakdown (string, 'budget_function/' or 'object_class/')
+    Output: Dataframe  results (pd.Dataframe), or None if the request failed
+    """
+    with spend_metrics.timer('breakdown_by',toptier_code=toptier_code,fiscal_year=year,breakdown=breakdown.strip('/')):
+        data = await spend_client.fetch(breakdown.strip('/'),toptier_code,year) # API call through the shared client
+    if data is not None: # If successful
+        return breakdown_frame(data)
+
+
+def breakdown_by(toptier_code,year,breakdown): # No st.cache here: spend_client caches responses, and st.cache can't hash its event loop
+    """
+    This function calls on the USASpending API to pull award data for one fiscal year broken down by budget function or object class, depending on the user's input.
+    Input: CGAC code (string), year (int), breakdown (string, 'budget_function/' or 'object_class/')
+    Output: Dataframe  results (pd.Dataframe), or None if the request failed
+    """
+    return spend_client.run(fetch_breakdown(toptier_code,year,breakdown))
+
+
+async def breakdown_all(toptier_code):
+    """
+    This function pulls both breakdowns for every year from 2017 to the latest one with published data in one concurrent batch. Start it with spend_client.submit() when an agency is selected, so the slider and radio buttons can render from memory.
     Input: CGAC code (string)
-    Output: Dataframe  results (pd.Dataframe)
+    Output: Dataframe of results by (year, breakdown) (dict)
+    """
+    keys = [(year,breakdown) for year in await spend_client.fiscal_years(spend_client.BREAKDOWN_FIRST_YEAR) for breakdown in ('budget_function/','object_class/')]
+    results = await spend_client.gather([spend_client.fetch(breakdown.strip('/'),toptier_code,year) for year, breakdown in keys])
+    return {key: breakdown_frame(data) for key, data in zip(keys,results) if data is not None}
+
+
+def compare_title(names):
+    """
+    This function titles the line chart comparing agencies' spending.
+    Input: names (dict, agency name by CGAC code, with the selected agency first)
+    Output: Title (string)
+    """
+    agency_names = list(names.values())
+    if len(agency_names) == 1:
+        return f'{agency_names[0]} - Spending by Fiscal Year'
+    if len(agency_names) == 2:
+        return f'Compare Spending - {agency_names[0]} and {agency_names[1]}'
+    return f'Compare Spending - {agency_names[0]} and {len(agency_names)-1} Other Agencies'
+
+
+async def breakdown_trend(toptier_code,breakdown):
+    """
+    This function pulls one breakdown for every year from 2017 to the latest one with published data in one concurrent batch, and builds a single long frame from all the years' records.
+    Input: CGAC code (string), breakdown (string, 'budget_function/' or 'object_class/')
+    Output: Dataframe of results with one row per year and category (pd.Dataframe), fiscal years that failed (list)
+    """
+    years = await spend_client.fiscal_years(spend_client.BREAKDOWN_FIRST_YEAR)
+    results = await spend_client.gather([spend_client.fetch(breakdown.strip('/'),toptier_code,year) for year in years])
+    records = [dict(item,fiscal_year=year) for year, data in zip(years,results) if data is not None for item in data['results']] # Tag each category with the year
+    return build_frame(records,'trend'), [year for year, data in zip(years,results) if data is None]
+
+
+def league_frame(records,year,names):
+    """
+    This function ranks agencies by spending for one fiscal year, with growth over the year before and share of the total, in one pass over a single frame of every agency's awards.
+    Input: records (list of dicts, awards records from process_year for year and year - 1), year (int), names (dict, agency name by CGAC code)
+    Output: Dataframe with one row per agency, highest spending first (pd.Dataframe)
+    """
+    df = build_frame(records,'historical')
+    wide = df.groupby(['toptier_code','Fiscal Year'],observed=True)['Spending'].sum().unstack().reindex(columns=[year-1,year]) # One row per agency, one column per year
+    league = pd.DataFrame({'Agency': wide.index.astype(str).map(names), 'Spending': wide[year], 'Growth': (wide[year] / wide[year-1] - 1).replace([np.inf,-np.inf],np.nan)})
+    league = league.dropna(subset=['Spending'])
+    league['Share'] = league['Spending'] / league['Spending'].sum()
+    league['Rank'] = league['Spending'].rank(ascending=False,method='min')
+    return league.sort_values('Rank').reset_index(drop=True)[['Rank','Agency','Spending','Growth','Share']]
+
+
+#### Page sections
+
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func) # Where Streamlit supports it, widgets inside a section only rerun that section
+
+def memo(key,func,*args):
+    """
+    This function keeps a computed value in session state, so reruns of the page reuse fetched data instead of pulling it again. None means the pull failed, so it isn't kept and the next rerun tries again.
+    Input: key (string), func (function), args (arguments for func)
+    Output: Stored value, or None
+    """
+    if key in st.session_state:
+        return st.session_state[key]
+    value = func(*args)
+    if value is not None:
+        st.session_state[key] = value
+    return value
+
+
+@fragment
+def drilldown_section(df,agency_name,code):
+    """
+    This function shows the drill-down into one subagency's components. Components are only loaded once a subagency is picked.
+    Input: df (pd.Dataframe, results of async_func(code,'category')), agency_name (string), code (string)
+    Output: None
+    """
+    subagencies = df.groupby('Subagency',observed=True)['Spending'].sum().sort_values(ascending=False).index.tolist() # Largest subagencies first
+    subagency = st.selectbox('Drill down into a subagency:', [' '] + subagencies) # Store user selection for subagency
+
+    if subagency != ' ': # If a subagency has been selected
+        children, failed = shared_frame(f'children_{code}',[code],'children') # Flatten each agency's components once per host
+        c = children[children['Subagency'] == subagency]
+
+        if c.shape[0]==0 and failed: # Nothing loaded for the subagency because requests failed
+            st.warning('Sorry, this subagency\'s components could not be loaded. Try again in a few minutes.')
+        elif c.shape[0]==0: # If the subagency has no components
+            st.caption('*USAspending data for this subagency is not broken down any further.')
+        elif failed: # Partial results aren't shared, so don't cache a figure drawn from them either
+            st.plotly_chart(spend_figures.component_figure(c,subagency), use_container_width=True)
+            failed_caption(failed,{code: agency_name})
+        else:
+            st.plotly_chart(spend_figures.cached(agency_name,f'component/{subagency}',None,spend_figures.component_figure,c,subagency,version=spend_shared.version(f'children_{code}')), use_container_width=True) # Show plot
+
+
+@fragment
+def compare_section(agency_name,code,agencylist):
+    """
+    This function shows the comparison with other agencies and, once agencies are chosen, the year section below it.
+    Input: agency_name (string), code (string), agencylist (dict, from agency_index)
+    Output: None
+    """
+    st.subheader(f'How does the {agency_name} compare to other agencies?') # Add a subheader
+    agency_names2 = st.multiselect("Choose other federal agencies to compare:", [a for a in agencylist if a not in (' ', agency_name)]) # Store user selections for the agencies to compare
+
+    if len(agency_names2) > 0: # If at least one agency has been selected
+        names = {code: agency_name} # Map each CGAC code in the chart to its agency name
+        for agency_name2 in agency_names2:
+            names.setdefault(agencylist[agency_name2]['CGAC'], agency_name2) # Store CGAC code for agency
+        if len(names) == 1: # If every selection shares the first agency's code
+            st.warning('In order to compare, you have to choose a different agency!') # Prompt the user to select a different agency
+        else:
+            key = 'compare_' + '_'.join(sorted(names)) # Same frame whichever agency was picked first
+            title = compare_title(names)
+            chart = st.empty()
+            h, failed = load_progressively(key,list(names),'historical',chart,lambda partial: spend_figures.compare_figure(partial.assign(Agency=partial['toptier_code'].map(names)),title)) # Pull award data for all agencies in one batch, drawing years as they arrive
+            h = h.assign(Agency=h['toptier_code'].map(names)) # Add column for agency name
+            a1 = h[h['toptier_code'] == code] # Keep the first agency's results for the sections below
+            missing = [name for c, name in names.items() if c not in set(h['toptier_code'])] # Agencies that returned 0 rows
+
+            unreachable = [names[c] for c in dict.fromkeys(c for c, year in failed) if c not in set(h['toptier_code'])] # Agencies with 0 rows because their requests failed
+
+            if len(unreachable) > 0: # If the API couldn't be reached for an agency
+                chart.empty()
+                st.warning(f'Sorry, USAspending could not be reached for {", ".join(unreachable)}. Try again in a few minutes.')
+                offline_section(names)
+            elif len(missing) > 0: # If results for any agency have 0 rows
+                chart.empty()
+                st.warning(f'Sorry, no data was found for {", ".join(missing)}! Choose a different agency to compare.') # Prompt the user to select another agency
+            else: # If results have more than 0 rows
+                if failed: # Partial data, so don't keep the figure
+                    chart.plotly_chart(spend_figures.compare_figure(h,title), use_container_width=True) # Show plot
+                else:
+                    chart.plotly_chart(spend_figures.cached(' / '.join(names.values()),'compare',None,spend_figures.compare_figure,h,title,version=spend_shared.version(key)), use_container_width=True) # Show plot
+                failed_caption(failed,names)
+
+                st.subheader('')
+                year_section(agency_name,code,a1)
+
+
+def offline_section(names):
+    """
+    This function draws the agencies' budget authority from the offline copy of the President's Budget Database, for when USAspending can't be reached. Budget authority is a different measure from the obligations in the live charts, so it gets its own labelled chart and is never mixed into them.
+    Input: names (dict, agency name by CGAC code)
+    Output: None
+    """
+    b = spend_pbdb.frame(list(names))
+    if b.shape[0] == 0: # Not built, or no actuals for these agencies
+        return
+    b = b.rename(columns={'Budget Authority':'Spending'}).assign(Agency=b['toptier_code'].map(names))
+    fig = spend_figures.compare_figure(b,f'Budget Authority (offline copy) - {", ".join(names.values())}')
+    fig.update_yaxes(title_text="Budget authority ($)") # Not obligations, so don't call it spending
+    st.plotly_chart(fig, use_container_width=True) # Show plot
+    st.caption(f'*Offline copy of the President\'s Budget Database, actual years through {spend_pbdb.last_actual_year()}. Budget authority is what an agency was allowed to spend, not the obligations USAspending reports, so it doesn\'t match the charts above.')
+
+
+@fragment
+def year_section(agency_name,code,a1):
     """
-    # Set url, endpoint, and payload (params) for API call
-    url = 'https://api.usaspending.gov'
-    endpoint=f'/api/v2/agency/{toptier_code}/{breakdown}'
-    payload = {"fiscal_year":year}
+    This function shows the fiscal year slider, the spending breakdown for that year and the what-if calculator.
+    Input: agency_name (string), code (string), a1 (pd.Dataframe, the agency's results of async_func_many(codes,'historical'))
+    Output: None
+    """
+    years = spend_client.run(spend_client.fiscal_years(spend_client.BREAKDOWN_FIRST_YEAR))
+    default = min(years[-1], spend_cache.current_fiscal_year() - 1) # Last closed fiscal year
+    year = st.slider('Select a particular fiscal year:',min_value = years[0], max_value = years[-1], value = default)
+    default = year
+
+    st.subheader(f'What did the {agency_name} spend money on in {default}?') # Add another subheader
+    st.caption(f'*Breakdown data is available starting in {spend_client.BREAKDOWN_FIRST_YEAR}.')
+    st.write('')
+
+    st.write('There are two main ways to break down federal spending.')
+
+    tab1, tab2 = st.tabs(['Budget Function', 'Object Class'])
+
+    tab1.subheader("What is a budget function?")
+    tab1.write('The federal budget is divided into approximately 20 categories, known as budget functions. These categories organize federal spending into topics based on the major purpose the spending serves (e.g., National Defense, Transportation, Health). These are further broken down into budget sub functions.')
+
+    tab2.subheader("What is an object class?")
+    tab2.write('Object class is one way to classify financial data in the federal budget. An object class groups obligations by the types of items or services purchased by the federal government. (e.g. Personnel Compensation and Equipment).')
+
+    st.write('Learn more from the [Glossary of Terms Used in the Federal Budget Process](https://www.gao.gov/assets/gao-05-734sp.pdf).')
+
+    st.subheader('')
+    select = st.radio("Breakdown spending by:",('Budget Function','Object Class')) # Store user's selection of breakdown method from radio buttons
+
+    # Set end of API endpoint based on user selection
+    if select == 'Budget Function':
+        breakdown = 'budget_function/'
+    elif select == 'Object Class':
+        breakdown = 'object_class/'
+
+    prefetch = f'breakdowns_{code}_{spend_client.revision(code)}'
+    breakdowns = memo(prefetch,lambda: spend_client.submit(breakdown_all(code))).result() # Prefetched when the agency was selected
+    if len(breakdowns) < 2 * len(years): # Some requests failed, so prefetch again on the next rerun
+        st.session_state.pop(prefetch, None)
+    df_breakdown_raw = breakdowns.get((year,breakdown)) # Look up the selected year and breakdown
+    if df_breakdown_raw is None: # Not prefetched, e.g. the request failed
+        df_breakdown_raw = memo(f'breakdown_{code}_{year}_{breakdown}_{spend_client.revision(code)}',breakdown_by,code,year,breakdown) # Run function to pull breakdown data
+
+    if df_breakdown_raw is None or df_breakdown_raw.shape[0]==0: # If results have 0 rows
+        st.warning('Sorry, no data was found! Try another option.') # Prompt the user to select a different agency
+    else: # If results have more than 0 rows
+        st.plotly_chart(spend_figures.cached(agency_name,breakdown,year,spend_figures.breakdown_figure,df_breakdown_raw,agency_name,select,year,version=spend_client.revision(code)), use_container_width=True) # Show plot
+
+    trend_section(agency_name,code,select,breakdown)
+
+    calculator_section(agency_name,year,a1)
+
+
+def trend_section(agency_name,code,select,breakdown):
+    """
+    This function shows how the agency's spending by budget function or object class changed from 2017 onward. The breakdowns prefetched for the year slider are in the response cache, so this is usually drawn without waiting on the API.
+    Input: agency_name (string), code (string), select (string, 'Budget Function' or 'Object Class'), breakdown (string, 'budget_function/' or 'object_class/')
+    Output: None
+    """
+    st.subheader(f'How has the {agency_name}\'s spending by {select.lower()} changed since {spend_client.BREAKDOWN_FIRST_YEAR}?') # Add another subheader
+    key = f'trend_{breakdown.strip("/")}_{code}'
+    t = spend_shared.read(key,since=spend_client.changed(code),max_age=spend_cache.OPEN_YEAR_TTL)
+    failed = []
+    if t is None:
+        t, failed = spend_client.run(breakdown_trend(code,breakdown))
+        if not failed: # Partial data isn't shared, so the next rerun tries those years again
+            t = spend_shared.publish(key,t)
+
+    if t.shape[0]==0: # If results have 0 rows
+        st.warning('Sorry, no data was found! Try another option.')
+    else:
+        if failed: # Partial data, so don't keep the figure
+            st.plotly_chart(spend_figures.trend_figure(t,agency_name,select), use_container_width=True) # Show plot
+        else:
+            st.plotly_chart(spend_figures.cached(agency_name,f'trend/{breakdown}',None,spend_figures.trend_figure,t,agency_name,select,version=spend_shared.version(key)), use_container_width=True) # Show plot
+        if t['Fiscal Year'].max() >= spend_cache.current_fiscal_year():
+            st.caption(f'*Fiscal year {spend_cache.current_fiscal_year()} is still being reported, so its totals will grow.')
+        failed_caption([(code, year) for year in failed],{code: agency_name})
+
+
+@fragment
+def league_section():
+    """
+    This function shows every agency in the catalog ranked by spending for a chosen fiscal year. The table fills in while the requests come back, and it is only loaded when asked for because it needs two requests per agency. It sits below the agency views, so they render first. Agencies whose ranked year failed are left out, and agencies whose year before failed have no growth; both are listed below the table.
+    Input: None
+    Output: None
+    """
+    st.subheader('Which agencies spend the most?') # Add a subheader
+    if not st.checkbox('Rank every federal agency by spending'):
+        return
+    year = st.selectbox('Fiscal year to rank:', spend_client.run(spend_client.fiscal_years())[:0:-1]) # Latest year first; the first year has no year before it to compare with
+
+    names = spend_catalog.agency_names(CATALOG_PATH) # First catalog name for each CGAC code
+
+    key = f'league_{year}'
+    table = st.empty()
+    league = spend_shared.read(key,since=spend_client.changed(),max_age=spend_cache.OPEN_YEAR_TTL) # Rebuilt once refreshed data arrives
+    failed = []
+    if league is None:
+        jobs = [(code, y) for code in names for y in (year-1, year)]
+        progress = st.progress(0)
+        records = []
+        for done, (position, result) in enumerate(spend_client.stream([process_year(y,code,'historical') for code, y in jobs]), 1):
+            if result is None: # A failed ranked year leaves the agency out; a failed year before only leaves out its growth
+                failed.append(jobs[position])
+            else:
+                records.extend(result)
+            if done % 20 == 0 or done == len(jobs): # Redraw the partial ranking every few responses
+                progress.progress(done / len(jobs))
+                table.dataframe(league_frame(records,year,names), use_container_width=True)
+        progress.empty()
+        league = league_frame(records,year,names)
+        if not failed: # Partial rankings aren't shared, so the next rerun tries those agencies again
+            league = spend_shared.publish(key,league)
+
+    table.dataframe(league.style.format({'Rank': '{:.0f}', 'Spending': '${:,.0f}', 'Growth': lambda x: '' if pd.isna(x) else f'{x:+.1%}', 'Share': '{:.1%}'}), use_container_width=True)
+    missing = sorted(names[code] for code, y in failed if y == year)
+    if missing:
+        st.caption(f'*{len(missing)} agencies could not be loaded and are left out of this ranking: {", ".join(missing)}. They will be retried on the next update.')
+    no_growth = sorted(names[code] for code, y in failed if y == year-1 and (code, year) not in failed)
+    if no_growth:
+        st.caption(f'*{year-1} spending could not be loaded for {len(no_growth)} agencies, so their growth is unavailable: {", ".join(no_growth)}. It will be retried on the next update.')
+    if league.shape[0] > 0:
+        if failed: # Partial data, so don't keep the figure
+            st.plotly_chart(spend_figures.league_figure(league,year), use_container_width=True) # Show plot
+        else:
+            st.plotly_chart(spend_figures.cached('all agencies','league',year,spend_figures.league_figure,league,year,version=spend_shared.version(key)), use_container_width=True) # Show plot
+
+
+def debug_panel():
+    """
+    This function shows the request log, stage timings and cache hit counts collected by spend_metrics. It is hidden unless the page is opened with ?debug=1 or SPENDAPP_DEBUG=1 is set.
+    Input: None
+    Output: None
+    """
+    with st.expander('Debug'):
+        st.write(spend_metrics.counts()) # Cache hits and misses by source
+        requests_log = spend_metrics.events('request')
+        if requests_log.shape[0] > 0:
+            st.plotly_chart(px.histogram(requests_log, x='seconds', color='status', title='Request latency (s)'), use_container_width=True)
+            st.dataframe(requests_log.groupby('status').agg(requests=('seconds','size'),median_s=('seconds','median'),p95_s=('seconds',lambda x: x.quantile(0.95)),bytes=('bytes','sum'),retries=('retries','sum')))
+        stages = spend_metrics.events('stage')
+        if stages.shape[0] > 0:
+            st.plotly_chart(px.histogram(stages, x='seconds', color='stage', title='Stage timings (s)'), use_container_width=True)
+            st.dataframe(stages.groupby('stage')['seconds'].describe(percentiles=[0.5,0.95]))
+
+
+def calculator_section(agency_name,year,a1):
+    """
+    This function shows the what-if calculator. The inputs sit in a form, so typing a number doesn't rerun anything until the user presses Calculate.
+    Input: agency_name (string), year (int), a1 (pd.Dataframe, the agency's results of async_func_many(codes,'historical'))
+    Output: None
+    """
+    st.subheader(f'What could we pay for with the {agency_name}\'s {year} spending?') # Add another subheader
+    st.text('(Based on estimates found online)') # And some more text
+    spending = a1.loc[a1['Fiscal Year'] == year, 'Spending']
+    if spending.shape[0]==0: # The year failed to load and was left out of the compare frame
+        st.warning(f'Sorry, the {agency_name}\'s {year} spending could not be loaded, so the calculator is unavailable. Try again in a few minutes.')
+        return
+    spend2021 = spending.iloc[0] # Store agency 1's 2021 spending amount from results of earlier function call (for line graph)
+
+    with st.form('calculator'):
+        st.markdown('<h4 align="center">Some costly (but important) expenditures</h4>', unsafe_allow_html=True) # Add a subheader
+        # Create 3 columns for number widgets and put one st. number widget in each column
+        # Each widget has a title and also indicates that the user can enter integers on the interval of 1
+        # Store the value of the user's input
+        col1, col2, col3 = st.columns(3)
+        num1 = col1.number_input('Clean water for everyone in the world - $10B',step=1)
+        num2 = col2.number_input('Deliver broadband internet to everyone in the U.S. - $80B',step=1)
+        num3 = col3.number_input('Resettle 1.2M Afghan refugees - $18.2B',step=1)
+        # Create another row of 3 widgets
+        col1, col2, col3 = st.columns(3)
+        num4 = col1.number_input('End hunger in the U.S. - $25B',step=1)
+        num5 = col2.number_input('End homelessness in the U.S. - $20B',step=1)
+        num6 = col3.number_input('Pay off all outstanding U.S. private student debt - $131.1B',step=1)
+
+        st.markdown('<h4 align="center">Just for fun</h4>', unsafe_allow_html=True) # Add a subheader
+        # Create another row of 3 widgets
+        col1, col2, col3 = st.columns(3)
+        num7 = col1.number_input('Buy the Mona Lisa - $900M',step=1)
+        num8 = col2.number_input('Buy the Washington Wizards - $1.93B',step=1)
+        num9 = col3.number_input('Jeff Bezos\' net worth - $151.8B',step=1)
+
+        st.form_submit_button('Calculate')
+
+    # Calculate the total 'spend' by the user based on their inputs and the 'price' of each item
+    receipt = -(num1*10000000000) - (num2*80000000000) - (num3*18200000000) - (num4*25000000000) - (num5*20000000000) - (num6*131100000000) - (num7*900000000) - (num8*1930000000) - (num9*151800000000)
+
+    spend2021 = spend2021 + receipt # Subtract the total 'spend' from agency 1's 2021 expenditures to calculate the balance
+
+    s = "{:,.2f}".format(spend2021) # Reformaat the balance with commas
+    receipt_output = "{:,.2f}".format(receipt) # Reformat the total 'spend' with commas
+    spend_output = f'${s}' # Show balance with a dollar sign
+    col1, col2, col3 = st.columns(3) # Create 5 columns
+    budget = col2.metric(label="Left to spend", value=spend_output, delta=receipt_output) # Show balance widget centered in column 3, and use receipt output to show the delta after each user selection
 
-    # API call
-    response = requests.get(f'{url}{endpoint}',params=payload)
-    # Check response
-    if response.status_code == 200: # If successful
-        data = response.json() # Store results
-        df = pd.DataFrame(data['results']) # Convert to df
-        df = df.rename(columns={"name":"Breakdown","obligated_amount":"Spending"}) # Rename columns
-        return df
 
 
 #### App starts here
@@ -137,15 +632,15 @@ if __name__ == "__main__":
     st.write(f'This data reflects an agency\'s obligated amounts, which are based on an agency\'s written commitments to use funds for a specific purpose. Check out the [Federal Spending Transparency Data Standards](https://portal.max.gov/portal/assets/public/offm/DataStandardsFinal.htm) to learn more about obligations and other terminology. Choose a federal agency below to explore their spending data.')
     st.subheader('')
 
-    agencylist = CGAC_list() # Load CGAC list as df
-    agencies = agencylist['AGENCY NAME'].tolist() # Convert agency names to list for dropdown menus
+    agencylist = agency_index() # Load CGAC list indexed by agency name
+    agencies = list(agencylist) # Agency names for dropdown menus
 
     agency_name = st.selectbox("Choose a federal agency:", agencies) # Store user selection for agency name
 
     if agency_name != ' ': # If agency name has been selected
-        code = agencylist.loc[agencylist['AGENCY NAME'] == agency_name, 'CGAC'].item() # Store corresponding CGAC code for agency
-        link = agencylist.loc[agencylist['AGENCY NAME'] == agency_name, 'Website'].item() # Store corresponding link for agency
-        text = agencylist.loc[agencylist['AGENCY NAME'] == agency_name, 'Description'].item()
+        code = agencylist[agency_name]['CGAC'] # Store corresponding CGAC code for agency
+        link = agencylist[agency_name]['Website'] # Store corresponding link for agency
+        text = agencylist[agency_name]['Description']
 
         if text != '':
             st.subheader(f'[{agency_name}]({link})')
@@ -153,163 +648,38 @@ if __name__ == "__main__":
         elif text == '':
             st.subheader(f'{agency_name}')
 
-        data_load_state = st.text('Loading data...') # Show a message to indicate data is loading
-        df = asyncio.run(async_func(code,'category'))
+        memo(f'breakdowns_{code}_{spend_client.revision(code)}',lambda: spend_client.submit(breakdown_all(code))) # Start loading the breakdown section in the background
 
-        if df.shape[0]==0: # If df of results had 0 rows
+        notes = st.container() # Captions go above the chart, once all years are in
+        chart = st.empty()
+        df, failed = load_progressively(f'category_{code}',[code],'category',chart,lambda partial: spend_figures.subagency_figure(partial,agency_name)) # Draw years as they arrive
+
+        if df.shape[0]==0 and failed: # If the API couldn't be reached
+            chart.empty()
+            st.warning('Sorry, USAspending could not be reached. Try again in a few minutes.')
+            offline_section({code: agency_name})
+        elif df.shape[0]==0: # If df of results had 0 rows
+            chart.empty()
             st.warning('Sorry, no data was found! Try a different agency.') # Prompt the user to select another agency
-            data_load_state.empty() # Clear warning message
         else: # If results are more than 0 rows
-            if df.shape[0]<14:
-                st.caption('*USAspending data for this agency is not available for all years.')
-            elif df.shape[0]<=15:
-                st.caption('*Detailed USAspending data is not available at the subagency level for this agency.')
-
-            # Create segmented bar chart
-            fig = px.bar(df, x="Fiscal Year", y="Spending", color="Subagency",title=f'{agency_name} - Spending by Subagency',color_discrete_sequence=px.colors.qualitative.Prism) # Create plot and set title and colors
+            n_years = len(spend_client.run(spend_client.fiscal_years()))
+            if df.shape[0]<n_years-1:
+                notes.caption('*USAspending data for this agency is not available for all years.')
+            elif df.shape[0]<=n_years:
+                notes.caption('*Detailed USAspending data is not available at the subagency level for this agency.')
 
-            fig.update_xaxes(title_text="Fiscal Year") # Name x axis
-            fig.update_yaxes(title_text="Spending ($)") # Name y axis
-            fig.update_layout(height=700,font=dict(size=16),showlegend=False,title_x=0.5) # Set plot height, font size, hide legend, and center plot title
-            #df['hoverdata'] = df['Spending'].apply(human_format)
-            #fig.update_traces(customdata=df['hoverdata'],hovertemplate = "%{color} <br> %{customdata} </br><extra></extra>")
+            if failed: # Partial data, so don't keep the figure
+                chart.plotly_chart(spend_figures.subagency_figure(df,agency_name), use_container_width=True) # Show plot
+            else:
+                chart.plotly_chart(spend_figures.cached(agency_name,'subagency',None,spend_figures.subagency_figure,df,agency_name,version=spend_shared.version(f'category_{code}')), use_container_width=True) # Show plot
+            failed_caption(failed,{code: agency_name})
 
-            st.plotly_chart(fig, use_container_width=True) # Show plot
+            drilldown_section(df,agency_name,code)
+            compare_section(agency_name,code,agencylist)
 
-            data_load_state.text('Loading data...done!') # Show messagge to indicate data has loaded
-            time.sleep(1) # Wait one second
-            data_load_state.empty() # Clear loading message
-
-            st.subheader(f'How does the {agency_name} compare to other agencies?') # Add a subheader
-            agency_name2 = st.selectbox("Choose another federal agency to compare:", agencies) # Store user selection for agency name 2
+    st.subheader('')
+    league_section()
 
-            if agency_name2 != ' ': # If agency name 2 has been selected
-                code2 = agencylist.loc[agencylist['AGENCY NAME'] == agency_name2, 'CGAC'].item() # Store CGAC code for agency
-                if agency_name2 == agency_name: # If agency name and agency 2 name are the same
-                    st.warning('In order to compare, you have to choose a different agency!') # Prompt the user to select a different agency
-                else:
-                    data_load_state = st.text('Loading data...') # Show data loading message
-                    counter = 1 # Set counter = 1
-                    for d in [code, code2]: # For agency 1 and agency 2
-                        if counter==1: # If counter = 1, store results for agency 1 and add column for name
-                            a1 = asyncio.run(async_func(d,'historical')) # Run function to pull award data
-                            a1.insert(loc = 1,column = 'Agency',value = agency_name)
-                        elif counter==2: # If counter = 2, store results for agency 2 and add column for name
-                            a2 = asyncio.run(async_func(d,'historical')) # Run function to pull award data
-                            a2.insert(loc = 1,column = 'Agency',value = agency_name2)
-                        counter += 1 # Add 1 to counter
-
-                    if a1.shape[0]==0 or a2.shape[0]==0: # If results for agency 1 or agency 2 have 0 rows
-                        st.warning('Sorry, no data was found! Choose a different agency to compare.') # Prompt the user to select another agency
-                        data_load_state.empty() # Clear warning message
-                    else: # If results have more than 0 rows
-                        h = a1.append(a2) # Combine agency 1 and 2 results into df
-                         # Create double line chart
-                        fig = px.line(h, x='Fiscal Year', y='Spending', color='Agency',title=f'Compare Spending - {agency_name} and {agency_name2}',  color_discrete_sequence=px.colors.qualitative.G10) # Create plot, set title and colors
-
-                        fig.update_xaxes(title_text="Fiscal Year") # Name x axis
-                        fig.update_yaxes(title_text="Spending ($)") # Name y axis
-                        fig.update_layout(height=600,font=dict(size=16),legend=dict(yanchor="bottom",y=-0.4,xanchor="center",x=0.5,orientation="h"),title_x=0.5) # Set plot height, font size, move legent to bottom center, center title
-                        fig.update_traces(line=dict(width=3)) # Increase line thickness
-                        fig.update_traces(mode="markers+lines", hovertemplate=None)
-                        h['hoverdata'] = h['Spending'].apply(human_format)
-                        fig.update_layout(hovermode="x")
-                        #fig.update_traces(customdata = h['hoverdata'],hovertemplate = "%{customdata}")
-                        fig.update_traces(hovertemplate = "%{y}")
-
-                        st.plotly_chart(fig, use_container_width=True) # Show plot
-
-                        data_load_state.text('Loading data...done!') # Show message that data has loaded
-                        time.sleep(1) # Wait for one second
-                        data_load_state.empty() # Clear data load message
-
-                        st.subheader('')
-
-                        default = 2021
-                        year = st.slider('Select a particular fiscal year:',min_value = 2017, max_value = 2022, value = default)
-                        default = year
-
-                        st.subheader(f'What did the {agency_name} spend money on in {default}?') # Add another subheader
-                        st.caption('*Breakdown data is available starting in 2017.')
-                        st.write('')
-
-                        st.write('There are two main ways to break down federal spending.')
-
-                        tab1, tab2 = st.tabs(['Budget Function', 'Object Class'])
-                        data = np.random.randn(10, 1)
-
-                        tab1.subheader("What is a budget function?")
-                        tab1.write('The federal budget is divided into approximately 20 categories, known as budget functions. These categories organize federal spending into topics based on the major purpose the spending serves (e.g., National Defense, Transportation, Health). These are further broken down into budget sub functions.')
-
-                        tab2.subheader("What is an object class?")
-                        tab2.write('Object class is one way to classify financial data in the federal budget. An object class groups obligations by the types of items or services purchased by the federal government. (e.g. Personnel Compensation and Equipment).')
-
-                        st.write('Learn more from the [Glossary of Terms Used in the Federal Budget Process](https://www.gao.gov/assets/gao-05-734sp.pdf).')
-
-                        st.subheader('')
-                        select = st.radio("Breakdown spending by:",('Budget Function','Object Class')) # Store user's selection of breakdown method from radio buttons
-
-                        # Set end of API endpoint based on user selection
-                        if select == 'Budget Function':
-                            breakdown = 'budget_function/'
-                        elif select == 'Object Class':
-                            breakdown = 'object_class/'
-
-                        data_load_state = st.text('Loading data...') # Show data loading message
-                        df_breakdown_raw = breakdown_by(code,year,breakdown) # Run function to pull breakdown data
-                        b = df_breakdown_raw.copy() # Create a copy
-
-                        if b.shape[0]==0: # If results have 0 rows
-                            st.warning('Sorry, no data was found! Try another option.') # Prompt the user to select a different agency
-                            data_load_state.empty() # Clear warning message
-                        else: # If results have more than 0 rows
-
-                            b['hoverdata'] = b['Spending'].apply(human_format)
-
-                            # Create pie chart
-                            fig = go.Figure(data=[go.Pie(labels=b['Breakdown'], values=b['Spending'])]) # Create plot
-                            fig.update_traces(textfont_size=16,marker=dict(colors=px.colors.qualitative.Prism),rotation=140) # Set colors and font size, and rotate plot 140 degress so that slice labels don't overlap with plot title
-                            fig.update_layout(height=700,font=dict(size=16),showlegend=True,title=f'{agency_name} - Spending Breakdown by {select}, {year}',title_x=0.5) # Set plot height, font size, title, and center title
-                            fig.update_traces(customdata=b['hoverdata'],hovertemplate = "%{label} <br> %{percent} </br> %{customdata}<extra></extra>")
-                            st.plotly_chart(fig, use_container_width=True) # Show plot
-
-                            data_load_state.text('Loading data...done!') # Show message that data has loaded
-                            time.sleep(1) # Wait one second
-                            data_load_state.empty() # Clear data load message
-
-                        st.subheader(f'What could we pay for with the {agency_name}\'s {year} spending?') # Add another subheader
-                        st.text('(Based on estimates found online)') # And some more text
-                        str_year = str(year)
-                        spend2021 = a1.loc[a1['Fiscal Year'] == str_year, 'Spending'].item() # Store agency 1's 2021 spending amount from results of earlier function call (for line graph)
-
-                        st.markdown('<h4 align="center">Some costly (but important) expenditures</h4>', unsafe_allow_html=True) # Add a subheader
-                        # Create 3 columns for number widgets and put one st. number widget in each column
-                        # Each widget has a title and also indicates that the user can enter integers on the interval of 1
-                        # Store the value of the user's input
-                        col1, col2, col3 = st.columns(3)
-                        num1 = col1.number_input('Clean water for everyone in the world - $10B',step=1)
-                        num2 = col2.number_input('Deliver broadband internet to everyone in the U.S. - $80B',step=1)
-                        num3 = col3.number_input('Resettle 1.2M Afghan refugees - $18.2B',step=1)
-                        # Create another row of 3 widgets
-                        col1, col2, col3 = st.columns(3)
-                        num4 = col1.number_input('End hunger in the U.S. - $25B',step=1)
-                        num5 = col2.number_input('End homelessness in the U.S. - $20B',step=1)
-                        num6 = col3.number_input('Pay off all outstanding U.S. private student debt - $131.1B',step=1)
-
-                        st.markdown('<h4 align="center">Just for fun</h4>', unsafe_allow_html=True) # Add a subheader
-                        # Create another row of 3 widgets
-                        col1, col2, col3 = st.columns(3)
-                        num7 = col1.number_input('Buy the Mona Lisa - $900M',step=1)
-                        num8 = col2.number_input('Buy the Washington Wizards - $1.93B',step=1)
-                        num9 = col3.number_input('Jeff Bezos\' net worth - $151.8B',step=1)
-
-                        # Calculate the total 'spend' by the user based on their inputs and the 'price' of each item
-                        receipt = -(num1*10000000000) - (num2*80000000000) - (num3*18200000000) - (num4*25000000000) - (num5*20000000000) - (num6*131100000000) - (num7*900000000) - (num8*1930000000) - (num9*151800000000)
-
-                        spend2021 = spend2021 + receipt # Subtract the total 'spend' from agency 1's 2021 expenditures to calculate the balance
-
-                        s = "{:,.2f}".format(spend2021) # Reformaat the balance with commas
-                        receipt_output = "{:,.2f}".format(receipt) # Reformat the total 'spend' with commas
-                        spend_output = f'${s}' # Show balance with a dollar sign
-                        col1, col2, col3 = st.columns(3) # Create 5 columns
-                        budget = col2.metric(label="Left to spend", value=spend_output, delta=receipt_output) # Show balance widget centered in column 3, and use receipt output to show the delta after each user selection
+    query_params = st.experimental_get_query_params() if hasattr(st,'experimental_get_query_params') else st.query_params.to_dict() # The query API was renamed in later Streamlit releases
+    if DEBUG or query_params.get('debug') in (['1'],'1'): # Hidden unless asked for
+        debug_panel()
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import datetime
+
+
+#### Settings
+
+CACHE_PATH = os.environ.get('SPENDAPP_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.spend_cache', 'responses.sqlite3')) # Location of the cache file
+CLOSED_YEAR_TTL = float(os.environ.get('SPENDAPP_CLOSED_YEAR_TTL', 30*24*60*60)) # Closed fiscal years rarely change, so keep them for 30 days
+OPEN_YEAR_TTL = float(os.environ.get('SPENDAPP_OPEN_YEAR_TTL', 60*60)) # The current fiscal year is still being reported, so refresh it every hour
+MAX_BYTES = int(os.environ.get('SPENDAPP_CACHE_MAX_BYTES', 200*1024*1024)) # Size cap for stored responses (200 MB)
+TOUCH_BATCH = 100 # Access times kept in memory before they are written out together
+
+_lock = threading.Lock() # Streamlit runs each session in its own thread, so serialize access to the cache file
+_con = None # (process id, connection), opened once per process
+_touched = {} # Access times not written yet: (endpoint, toptier_code, fiscal_year) -> time
+_total = None # Bytes stored, counted once and then kept up to date by put()
+
+
+#### Functions
+
+def current_fiscal_year(today=None):
+    """
+    This function returns the federal fiscal year for a date. The federal fiscal year starts on October 1st, so October-December count toward the next year.
+    Input: today (datetime.date, defaults to today's date)
+    Output: Fiscal year (int)
+    """
+    today = today or datetime.date.today()
+    return today.year + 1 if today.month >= 10 else today.year
+
+
+def ttl_for(fiscal_year):
+    """
+    This function returns how long a cached response stays fresh. Closed fiscal years are treated as effectively immutable, while the open fiscal year gets a short time-to-live.
+    Input: fiscal_year (int)
+    Output: Time-to-live in seconds (float)
+    """
+    if int(fiscal_year) < current_fiscal_year():
+        return CLOSED_YEAR_TTL
+    return OPEN_YEAR_TTL
+
+
+def _connect():
+    """
+    This function returns the cache database connection, opening it and creating the table on first use in each process. Hold _lock while using it.
+    Input: None
+    Output: Database connection (sqlite3.Connection)
+    """
+    global _con, _total
+    if _con is not None and _con[0] == os.getpid():
+        return _con[1]
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    con = sqlite3.connect(CACHE_PATH, timeout=30, check_same_thread=False) # Used from the client's worker threads, always under _lock
+    con.execute('PRAGMA journal_mode=WAL') # Readers in other processes don't wait for writers
+    con.execute('''CREATE TABLE IF NOT EXISTS responses (
+                       endpoint TEXT NOT NULL,
+                       toptier_code TEXT NOT NULL,
+                       fiscal_year INTEGER NOT NULL,
+                       body TEXT NOT NULL,
+                       size INTEGER NOT NULL,
+                       fetched_at REAL NOT NULL,
+                       accessed_at REAL NOT NULL,
+                       PRIMARY KEY (endpoint, toptier_code, fiscal_year))''')
+    con.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)') # Used to find the least recently used rows
+    con.commit()
+    _con = (os.getpid(), con)
+    _total = None
+    _touched.clear()
+    return con
+
+
+def _flush(con):
+    """
+    This function writes the access times collected by lookup() in one statement.
+    Input: con (sqlite3.Connection)
+    Output: None
+    """
+    if _touched:
+        con.executemany('UPDATE responses SET accessed_at=? WHERE endpoint=? AND toptier_code=? AND fiscal_year=?', [(t,) + key for key, t in _touched.items()])
+        _touched.clear()
+
+
+def lookup(endpoint, toptier_code, fiscal_year):
+    """
+    This function looks up a stored API response, including ones past their time-to-live, so callers can show stale data while a fresh copy is fetched.
+    Input: endpoint (string, e.g. 'awards'), toptier_code (string), fiscal_year (int)
+    Output: Parsed JSON response (dict) or None if nothing is stored, and whether it is still fresh (bool)
+    """
+    now = time.time()
+    key = (endpoint, str(toptier_code), int(fiscal_year))
+    with _lock:
+        con = _connect()
+        row = con.execute('SELECT body, fetched_at FROM responses WHERE endpoint=? AND toptier_code=? AND fiscal_year=?', key).fetchone()
+        if row is None: # Not cached
+            return None, False
+        body, fetched_at = row
+        _touched[key] = now # Mark as recently used, written out later with other lookups
+        if len(_touched) >= TOUCH_BATCH:
+            with con:
+                _flush(con)
+    return json.loads(body), now - fetched_at <= ttl_for(fiscal_year)
+
+
+def get(endpoint, toptier_code, fiscal_year):
+    """
+    This function looks up a stored API response. Expired responses are treated as missing.
+    Input: endpoint (string, e.g. 'awards'), toptier_code (string), fiscal_year (int)
+    Output: Parsed JSON response (dict), or None if there is no fresh copy
+    """
+    data, fresh = lookup(endpoint, toptier_code, fiscal_year)
+    return data if fresh else None
+
+
+def put(endpoint, toptier_code, fiscal_year, data):
+    """
+    This function stores an API response and evicts the least recently used responses if the cache is over its size cap.
+    Input: endpoint (string), toptier_code (string), fiscal_year (int), data (dict)
+    Output: None
+    """
+    global _total
+    now = time.time()
+    body = json.dumps(data)
+    key = (endpoint, str(toptier_code), int(fiscal_year))
+    with _lock:
+        con = _connect()
+        with con:
+            _flush(con)
+            if _total is None:
+                _total = con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            old = con.execute('SELECT size FROM responses WHERE endpoint=? AND toptier_code=? AND fiscal_year=?', key).fetchone()
+            con.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?)', key + (body, len(body), now, now))
+            _total += len(body) - (old[0] if old else 0)
+            if _total > MAX_BYTES: # Other processes write too, so recount before evicting
+                _evict(con)
+
+
+def _evict(con):
+    """
+    This function deletes the least recently used responses until the cache fits under MAX_BYTES.
+    Input: con (sqlite3.Connection)
+    Output: None
+    """
+    global _total
+    total = con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    _total = total
+    if total <= MAX_BYTES:
+        return
+    doomed = []
+    for endpoint, toptier_code, fiscal_year, size in con.execute('SELECT endpoint, toptier_code, fiscal_year, size FROM responses ORDER BY accessed_at'): # Oldest access first
+        if total <= MAX_BYTES:
+            break
+        doomed.append((endpoint, toptier_code, fiscal_year))
+        total -= size
+    con.executemany('DELETE FROM responses WHERE endpoint=? AND toptier_code=? AND fiscal_year=?', doomed)
+    _total = total
+
+
+def clear():
+    """
+    This function removes every stored response.
+    Input: None
+    Output: None
+    """
+    global _total
+    with _lock:
+        con = _connect()
+        with con:
+            con.execute('DELETE FROM responses')
+        _touched.clear()
+        _total = 0
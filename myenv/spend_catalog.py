@@ -0,0 +1,28 @@
+import os
+import json
+
+
+#### Settings
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Clean_Data', 'CGAC_list.json') # Agency catalog bundled with the app, written by py/Build_Catalog.py
+
+_names = {} # In-process copy of each catalog read so far: path -> (modified time, names)
+
+
+#### Functions
+
+def agency_names(path=CATALOG_PATH):
+    """
+    This function reads the agency catalog and returns the first catalog name for each agency code, reusing the in-process copy until the file changes. The catalog lists some agencies more than once, under other names.
+    Input: Path to CGAC_list.json (string, defaults to the catalog bundled with the app)
+    Output: Agency name by CGAC code, in catalog order (dict)
+    """
+    mtime = os.path.getmtime(path)
+    if path not in _names or _names[path][0] != mtime:
+        with open(path) as f:
+            records = json.load(f)
+        names = {}
+        for record in records:
+            names.setdefault(record['CGAC'], record['AGENCY NAME'])
+        _names[path] = (mtime, names)
+    return dict(_names[path][1]) # Copy, so callers can change it
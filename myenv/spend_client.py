@@ -0,0 +1,351 @@
+import os
+import json
+import math
+import time
+import queue
+import random
+import asyncio
+import threading
+import collections
+import aiohttp
+import spend_cache
+import spend_store
+import spend_metrics
+
+
+#### Settings
+
+BASE_URL = os.environ.get('SPENDAPP_API_URL', 'https://api.usaspending.gov') # USAspending API host
+MAX_PER_HOST = int(os.environ.get('SPENDAPP_MAX_PER_HOST', 10)) # Most requests in flight to one host at a time
+REQUEST_TIMEOUT = float(os.environ.get('SPENDAPP_REQUEST_TIMEOUT', 20)) # Deadline for a single request, in seconds
+OVERALL_TIMEOUT = float(os.environ.get('SPENDAPP_OVERALL_TIMEOUT', 60)) # Deadline for a whole batch of requests, in seconds
+RETRIES = int(os.environ.get('SPENDAPP_RETRIES', 3)) # Retries after the first attempt for transient failures
+BACKOFF_BASE = 0.5 # First backoff step, in seconds
+BACKOFF_CAP = 8 # Longest backoff step, in seconds
+
+RETRY_STATUSES = {429, 500, 502, 503, 504} # Statuses worth trying again
+PAGINATED = {'sub_agency', 'budget_function', 'object_class'} # Endpoints that return results a page at a time
+PAGE_LIMIT = 100 # Largest page size the API allows
+FIRST_YEAR = 2008 # First fiscal year the app shows
+BREAKDOWN_FIRST_YEAR = 2017 # First fiscal year with budget function and object class breakdowns
+BATCH_LIMIT = int(os.environ.get('SPENDAPP_BATCH_LIMIT', 20)) # Most coroutines of one stream() batch running at once, so a large fan-out doesn't crowd out other sessions
+
+_loop = None
+_session = None
+_inflight = {} # Requests in progress: (endpoint, toptier_code, fiscal_year) -> task. Only touched on the shared loop, so it needs no lock
+_refreshing = set() # Stale responses being refreshed in the background
+_revisions = collections.Counter() # Times an agency's data has changed after a background refresh
+_changed = {} # When each agency's data last changed after a background refresh
+_latest = None # (checked at, latest fiscal year with published data)
+_lock = threading.Lock()
+
+
+#### Functions
+
+def _get_loop():
+    """
+    This function starts (once per process) an event loop in a background thread. Streamlit reruns the app script on every interaction, so keeping the loop and its connection pool outside of the script lets them survive across reruns and sessions.
+    Input: None
+    Output: Running event loop (asyncio.AbstractEventLoop)
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='spend-client', daemon=True)
+            thread.start()
+    return _loop
+
+
+def run(coro, timeout=None):
+    """
+    This function runs a coroutine on the shared event loop and waits for its result. Use it in place of asyncio.run().
+    Input: coro (coroutine), timeout (seconds, optional)
+    Output: Result of the coroutine
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+def submit(coro):
+    """
+    This function starts a coroutine on the shared event loop without waiting for it, e.g. to prefetch data in the background.
+    Input: coro (coroutine)
+    Output: Handle to the result (concurrent.futures.Future)
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def get_session():
+    """
+    This function returns the shared aiohttp session, creating it on first use. It must be called from the shared event loop.
+    Input: None
+    Output: Shared session (aiohttp.ClientSession)
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=MAX_PER_HOST, ttl_dns_cache=300) # Caps in-flight requests per host and keeps connections alive between calls
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+    return _session
+
+
+def backoff(attempt, retry_after=None):
+    """
+    This function returns how long to wait before the next retry, using exponential backoff with full jitter.
+    Input: attempt (int, starting at 0), retry_after (seconds requested by the server, optional)
+    Output: Delay in seconds (float)
+    """
+    if retry_after is not None:
+        return min(BACKOFF_CAP, retry_after)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def log_request(path, params, status, size, retries, start):
+    """
+    This function records one finished API request for the metrics log.
+    Input: path (string), params (dict), status (HTTP status, or the error name if no response came back), size (response bytes), retries (int), start (time.perf_counter() when the first attempt began)
+    Output: None
+    """
+    params = params or {}
+    spend_metrics.record('request', path=path, fiscal_year=params.get('fiscal_year'), page=params.get('page', 1), status=status, bytes=size, retries=retries, seconds=time.perf_counter() - start)
+
+
+async def get_json(path, params=None):
+    """
+    This function sends a GET request to the USAspending API through the shared session. Timeouts, connection errors, 429s and 5xx responses are retried with jittered backoff.
+    Input: path (string, e.g. '/api/v2/agency/097/awards/'), params (dict)
+    Output: Parsed JSON response (dict), or None if the request did not succeed
+    """
+    status, data = await request(path, params)
+    return data
+
+
+async def request(path, params=None):
+    """
+    This function does the work behind get_json() and also returns the final status, so callers can tell an answer from the API (e.g. a 404) from an outage.
+    Input: path (string), params (dict)
+    Output: Status of the last attempt (int, or the error name if no response came back), parsed JSON response (dict) or None if the request did not succeed
+    """
+    session = get_session()
+    start = time.perf_counter()
+    status = None
+    for attempt in range(RETRIES + 1):
+        retry_after = None
+        try:
+            async with session.get(f'{BASE_URL}{path}', params=params) as resp:
+                status = resp.status
+                if resp.status == 200: # If successful
+                    body = await resp.read()
+                    log_request(path, params, status, len(body), attempt, start)
+                    return status, json.loads(body)
+                if resp.status not in RETRY_STATUSES: # Client errors won't fix themselves
+                    log_request(path, params, status, 0, attempt, start)
+                    return status, None
+                if resp.headers.get('Retry-After', '').isdigit():
+                    retry_after = float(resp.headers['Retry-After'])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = type(e).__name__ # Keep the error name for the request log
+        if attempt < RETRIES:
+            await asyncio.sleep(backoff(attempt, retry_after))
+    log_request(path, params, status, 0, RETRIES, start)
+    return status, None
+
+
+async def fetch_live(endpoint, toptier_code, fiscal_year):
+    """
+    This function pulls one fiscal year of an agency endpoint straight from the API, skipping the local store and cache. List endpoints are followed to their last page, and the pages after the first are requested concurrently.
+    Input: endpoint (string, e.g. 'awards', 'sub_agency', 'budget_function', 'object_class'), toptier_code (string), fiscal_year (int)
+    Output: Parsed JSON response with every page's results (dict), or None if any request did not succeed
+    """
+    path = f'/api/v2/agency/{toptier_code}/{endpoint}/'
+    params = {"fiscal_year": fiscal_year}
+    if endpoint not in PAGINATED:
+        return await get_json(path, params)
+
+    params['limit'] = PAGE_LIMIT
+    data = await get_json(path, params)
+    if data is None:
+        return None
+    meta = data.get('page_metadata') or {}
+    if meta.get('hasNext') and meta.get('total'): # Page count is known, so request the rest at once
+        pages = await asyncio.gather(*[get_json(path, dict(params, page=page)) for page in range(2, math.ceil(meta['total'] / (meta.get('limit') or PAGE_LIMIT)) + 1)])
+    else:
+        pages = []
+        page = 1
+        while meta.get('hasNext'): # Otherwise walk the pages in order
+            page += 1
+            nxt = await get_json(path, dict(params, page=page))
+            pages.append(nxt)
+            if nxt is None:
+                break
+            meta = nxt.get('page_metadata') or {}
+    if any(page is None for page in pages): # Don't return (or cache) a partial list
+        return None
+    for page in pages:
+        data['results'].extend(page['results'])
+    data['page_metadata'] = dict(data.get('page_metadata') or {}, hasNext=False, next=None)
+    return data
+
+
+async def fetch(endpoint, toptier_code, fiscal_year):
+    """
+    This function pulls one fiscal year of an agency endpoint. Callers asking for the same endpoint, agency and year while a request is in progress (e.g. several sessions opening the same agency) share that request instead of sending their own. The response is shared too, so callers must not modify it.
+    Input: endpoint (string, e.g. 'awards', 'sub_agency', 'budget_function', 'object_class'), toptier_code (string), fiscal_year (int)
+    Output: Parsed JSON response (dict), or None if the request did not succeed
+    """
+    key = (endpoint, str(toptier_code), int(fiscal_year))
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch(endpoint, toptier_code, fiscal_year))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight.pop(key, None))
+    else:
+        spend_metrics.count('fetch.coalesced')
+    return await asyncio.shield(task) # One caller timing out doesn't cancel the request for the others
+
+
+async def _fetch(endpoint, toptier_code, fiscal_year):
+    """
+    This function does the work behind fetch(). It reads from the prefetched local store when available, then the response cache, and only then calls the API. Expired cached responses, and store rows older than the cache's time-to-live (e.g. the open fiscal year an hour after Prefetch_Store.py pulled it), are still returned right away and refreshed in the background.
+    Input: endpoint (string, e.g. 'awards', 'sub_agency', 'budget_function', 'object_class'), toptier_code (string), fiscal_year (int)
+    Output: Parsed JSON response (dict), or None if the request did not succeed
+    """
+    loop = asyncio.get_running_loop()
+    stored = await loop.run_in_executor(None, spend_store.get, endpoint, toptier_code, fiscal_year) # Check the prefetched store first, off the loop like the cache
+    if stored is not None and (spend_store.age(endpoint, fiscal_year) or 0) <= spend_cache.ttl_for(fiscal_year):
+        spend_metrics.count('fetch.store')
+        return stored
+    data, fresh = await loop.run_in_executor(None, spend_cache.lookup, endpoint, toptier_code, fiscal_year) # Then the local cache, read off the loop so other sessions' requests keep moving
+    if data is None and stored is not None: # Stale store copy with nothing newer cached: serve it and refresh into the cache
+        data, fresh = stored, False
+    if data is not None:
+        spend_metrics.count('fetch.cache' if fresh else 'fetch.stale')
+        if not fresh and (endpoint, str(toptier_code), int(fiscal_year)) not in _refreshing: # Serve the stale copy now and refresh it in the background
+            _refreshing.add((endpoint, str(toptier_code), int(fiscal_year)))
+            asyncio.ensure_future(_refresh(endpoint, toptier_code, fiscal_year, data))
+        return data
+    spend_metrics.count('fetch.live')
+    data = await fetch_live(endpoint, toptier_code, fiscal_year)
+    if data is not None:
+        await loop.run_in_executor(None, spend_cache.put, endpoint, toptier_code, fiscal_year, data) # Store response for later sessions
+    return data
+
+
+async def _refresh(endpoint, toptier_code, fiscal_year, old):
+    """
+    This function re-pulls a stale cached or stored response. If the data changed, the agency's revision goes up so the app rebuilds its frames and charts on the next rerun.
+    Input: endpoint (string), toptier_code (string), fiscal_year (int), old (dict, the stale response)
+    Output: None
+    """
+    try:
+        data = await fetch_live(endpoint, toptier_code, fiscal_year)
+        if data is not None:
+            await asyncio.get_running_loop().run_in_executor(None, spend_cache.put, endpoint, toptier_code, fiscal_year, data)
+            if spend_store.to_rows(endpoint, toptier_code, fiscal_year, data) != spend_store.to_rows(endpoint, toptier_code, fiscal_year, old): # Compare the fields the store keeps, since store copies drop the rest (e.g. messages)
+                _revisions[str(toptier_code)] += 1
+                _changed[str(toptier_code)] = time.time()
+    finally:
+        _refreshing.discard((endpoint, str(toptier_code), int(fiscal_year)))
+
+
+def revision(toptier_code=None):
+    """
+    This function returns how many times an agency's data has been swapped for a newer copy in this process. Include it in keys for anything built from the data.
+    Input: toptier_code (string, optional, leave out to count every agency)
+    Output: Revision (int)
+    """
+    if toptier_code is None:
+        return sum(_revisions.values())
+    return _revisions[str(toptier_code)]
+
+
+def changed(*toptier_codes):
+    """
+    This function returns when agencies' data was last swapped for a newer copy in this process. Copies of frames built before then are out of date.
+    Input: toptier_codes (strings, leave out to check every agency)
+    Output: Time of the latest change (float), or 0 if none has changed
+    """
+    codes = [str(code) for code in toptier_codes] or list(_changed)
+    return max([_changed.get(code, 0) for code in codes], default=0)
+
+
+async def latest_fiscal_year():
+    """
+    This function returns the latest fiscal year with published data, from the dates USAspending reveals each submission period. The answer is kept for as long as an open fiscal year response, so new years show up without a code change. If the API can't be reached, it falls back to the last closed fiscal year.
+    Input: None
+    Output: Fiscal year (int)
+    """
+    global _latest
+    if _latest is None or time.time() - _latest[0] > spend_cache.OPEN_YEAR_TTL:
+        data = await get_json('/api/v2/references/submission_periods/')
+        now = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+        revealed = [period['submission_fiscal_year'] for period in (data or {}).get('available_periods', []) if (period.get('submission_reveal_date') or '9999')[:19] <= now]
+        if revealed:
+            _latest = (time.time(), max(revealed))
+        elif _latest is None:
+            _latest = (time.time(), spend_cache.current_fiscal_year() - 1) # Not reachable, so use the last closed fiscal year until the next check
+        else:
+            _latest = (time.time(), _latest[1]) # Keep the last answer until the next check
+    return _latest[1]
+
+
+async def fiscal_years(first=FIRST_YEAR):
+    """
+    This function returns every fiscal year from first up to the latest one with published data.
+    Input: first (int)
+    Output: Fiscal years, oldest first (list)
+    """
+    return list(range(first, await latest_fiscal_year() + 1))
+
+
+async def gather(coros, timeout=OVERALL_TIMEOUT):
+    """
+    This function runs coroutines concurrently under one overall deadline. Anything still running at the deadline is cancelled instead of holding up the rest.
+    Input: coros (list of coroutines), timeout (seconds)
+    Output: Results in the same order as coros, with None for ones that failed or ran out of time (list)
+    """
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    return [t.result() if t in done and t.exception() is None else None for t in tasks]
+
+
+def stream(coros, limit=BATCH_LIMIT, timeout=OVERALL_TIMEOUT):
+    """
+    This function runs a large batch of coroutines on the shared event loop, at most limit at a time, and hands back each result as soon as it is ready so the page can show partial results. Anything still running at the deadline is cancelled.
+    Input: coros (list of coroutines), limit (int), timeout (seconds)
+    Output: Generator of (position in coros, result) pairs in the order they finish, with None for ones that failed or ran out of time
+    """
+    results = queue.Queue() # Filled on the event loop thread, read on the caller's thread
+    coros = list(coros)
+
+    async def limited(semaphore, position, coro):
+        try:
+            async with semaphore:
+                value = await coro
+        except asyncio.CancelledError:
+            coro.close() # Never started if it was still waiting for the semaphore
+            raise
+        except Exception:
+            value = None
+        results.put((position, value))
+
+    async def batch():
+        semaphore = asyncio.Semaphore(limit) # Created on the loop, which Python 3.9 requires
+        tasks = [asyncio.ensure_future(limited(semaphore, position, coro)) for position, coro in enumerate(coros)]
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for position, task in enumerate(tasks):
+                if task in pending:
+                    task.cancel()
+                    results.put((position, None))
+        results.put(None) # Nothing left
+
+    submit(batch())
+    while True:
+        item = results.get()
+        if item is None:
+            return
+        yield item
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import spend_cache
+import spend_metrics
+
+
+#### Settings
+
+TOP_N = int(os.environ.get('SPENDAPP_TOP_N', 10)) # Largest categories drawn on their own; the rest are folded into OTHER
+OTHER = 'Other' # Label for the folded long tail
+MAX_FIGURES = int(os.environ.get('SPENDAPP_MAX_FIGURES', 256)) # Most serialized figures kept in memory
+
+UNITS = np.array(['', 'K', 'M', 'B', 'T']) # SI suffixes used by human_labels
+
+_figures = OrderedDict() # Serialized figures shared by every session: (agency, view, year, version) -> (built at, figure JSON)
+_lock = threading.Lock() # Streamlit runs each session in its own thread
+
+
+#### Functions
+
+def human_labels(values):
+    """
+    This function changes numbers to a human-interpretable SI format in one vectorized pass. It gives the same labels as human_format in spend_app.py.
+    Input: values (pd.Series or array of numbers)
+    Output: Formatted numbers (pd.Series of strings)
+    """
+    values = np.asarray(values, dtype=float)
+    size = np.abs(values)
+    digits = np.floor(np.log10(np.where(size > 0, size, 1))) # Order of magnitude of each value
+    rounded = np.round(values / 10 ** (digits - 2)) * 10 ** (digits - 2) # Keep 3 significant figures
+    magnitude = np.clip(np.floor(np.log10(np.where(rounded != 0, np.abs(rounded), 1)) / 3), 0, len(UNITS) - 1).astype(int)
+    scaled = pd.Series(np.round(rounded / 1000.0 ** magnitude, 10)) # Clear floating point noise left by the division
+    return scaled.astype(str).str.replace(r'\.0$', '', regex=True) + UNITS[magnitude]
+
+
+def fold_other(df, key, value='Spending', by=(), n=None):
+    """
+    This function keeps the n largest categories of a column and adds up everything else under OTHER, so charts for large departments don't draw dozens of tiny traces.
+    Input: df (pd.Dataframe), key (column to fold, string), value (column to add up, string), by (other columns to group by, e.g. ('Fiscal Year',)), n (int, defaults to TOP_N)
+    Output: Dataframe with at most n + 1 categories, largest first (pd.Dataframe)
+    """
+    n = TOP_N if n is None else n
+    totals = df.groupby(key, observed=True, sort=False)[value].sum().sort_values(ascending=False)
+    order = list(totals.index[:n]) + ([OTHER] if len(totals) > n else [])
+    rank = {name: i for i, name in enumerate(order)}
+    labels = df[key].astype(object).where(df[key].isin(totals.index[:n]), OTHER)
+    folded = df.assign(**{key: labels}).groupby(list(by) + [key], sort=False, as_index=False)[value].sum()
+    return folded.sort_values(list(by) + [key], key=lambda col: col.map(rank) if col.name == key else col, ignore_index=True) # Largest first and OTHER last, so colors and legend order stay stable
+
+
+def subagency_figure(df, agency_name):
+    """
+    This function builds the segmented bar chart of spending by subagency.
+    Input: df (pd.Dataframe, results of async_func(code,'category')), agency_name (string)
+    Output: Plot (go.Figure)
+    """
+    df = fold_other(df, 'Subagency', by=('Fiscal Year',))
+    df['hoverdata'] = human_labels(df['Spending'])
+    fig = px.bar(df, x="Fiscal Year", y="Spending", color="Subagency", custom_data=['hoverdata'], title=f'{agency_name} - Spending by Subagency', color_discrete_sequence=px.colors.qualitative.Prism) # Create plot and set title and colors
+
+    fig.update_xaxes(title_text="Fiscal Year", dtick=1) # Name x axis and label every year
+    fig.update_yaxes(title_text="Spending ($)") # Name y axis
+    fig.update_layout(height=700, font=dict(size=16), showlegend=False, title_x=0.5) # Set plot height, font size, hide legend, and center plot title
+    fig.update_traces(hovertemplate="%{fullData.name} <br> %{x}: %{customdata[0]} </br><extra></extra>")
+    return fig
+
+
+def component_figure(c, subagency):
+    """
+    This function builds the segmented bar chart of spending by component for one subagency.
+    Input: c (pd.Dataframe, rows of async_func(code,'children') for the subagency), subagency (string)
+    Output: Plot (go.Figure)
+    """
+    c = fold_other(c, 'Component', by=('Fiscal Year',))
+    c['hoverdata'] = human_labels(c['Spending'])
+    fig = px.bar(c, x="Fiscal Year", y="Spending", color="Component", custom_data=['hoverdata'], title=f'{subagency} - Spending by Component', color_discrete_sequence=px.colors.qualitative.Prism) # Create plot and set title and colors
+
+    fig.update_xaxes(title_text="Fiscal Year", dtick=1) # Name x axis and label every year
+    fig.update_yaxes(title_text="Spending ($)") # Name y axis
+    fig.update_layout(height=600, font=dict(size=16), showlegend=False, title_x=0.5) # Set plot height, font size, hide legend, and center plot title
+    fig.update_traces(hovertemplate="%{fullData.name} <br> %{x}: %{customdata[0]} </br><extra></extra>")
+    return fig
+
+
+def compare_figure(h, title):
+    """
+    This function builds the line chart comparing agencies' spending.
+    Input: h (pd.Dataframe, results of async_func_many(codes,'historical') with an 'Agency' column), title (string)
+    Output: Plot (go.Figure)
+    """
+    fig = px.line(h, x='Fiscal Year', y='Spending', color='Agency', title=title, color_discrete_sequence=px.colors.qualitative.G10) # Create plot, set title and colors
+
+    fig.update_xaxes(title_text="Fiscal Year", dtick=1) # Name x axis and label every year
+    fig.update_yaxes(title_text="Spending ($)") # Name y axis
+    fig.update_layout(height=600, font=dict(size=16), legend=dict(yanchor="bottom", y=-0.4, xanchor="center", x=0.5, orientation="h"), title_x=0.5) # Set plot height, font size, move legent to bottom center, center title
+    fig.update_traces(line=dict(width=3)) # Increase line thickness
+    fig.update_traces(mode="markers+lines", hovertemplate="%{y}")
+    fig.update_layout(hovermode="x")
+    return fig
+
+
+def breakdown_figure(b, agency_name, select, year):
+    """
+    This function builds the pie chart of spending by budget function or object class.
+    Input: b (pd.Dataframe, results of breakdown_by), agency_name (string), select (string, 'Budget Function' or 'Object Class'), year (int)
+    Output: Plot (go.Figure)
+    """
+    b = fold_other(b, 'Breakdown')
+    hoverdata = human_labels(b['Spending'])
+
+    fig = go.Figure(data=[go.Pie(labels=b['Breakdown'], values=b['Spending'], sort=False)]) # Create plot
+    fig.update_traces(textfont_size=16, marker=dict(colors=px.colors.qualitative.Prism), rotation=140) # Set colors and font size, and rotate plot 140 degress so that slice labels don't overlap with plot title
+    fig.update_layout(height=700, font=dict(size=16), showlegend=True, title=f'{agency_name} - Spending Breakdown by {select}, {year}', title_x=0.5) # Set plot height, font size, title, and center title
+    fig.update_traces(customdata=hoverdata, hovertemplate="%{label} <br> %{percent} </br> %{customdata}<extra></extra>")
+    return fig
+
+
+def trend_figure(t, agency_name, select):
+    """
+    This function builds the stacked area chart of spending by budget function or object class over the years. The long frame is reshaped with one pivot into a category by year table, with 0 for years a category has no spending, so the areas stack on the same years.
+    Input: t (pd.Dataframe, results of breakdown_trend), agency_name (string), select (string, 'Budget Function' or 'Object Class')
+    Output: Plot (go.Figure)
+    """
+    t = fold_other(t, 'Breakdown', by=('Fiscal Year',))
+    wide = t.pivot(index='Breakdown', columns='Fiscal Year', values='Spending').fillna(0) # One row per category, one column per year
+    order = wide.sum(axis=1).sort_values(ascending=False).index
+    wide = wide.loc[[name for name in order if name != OTHER] + [name for name in order if name == OTHER]] # Largest at the bottom of the stack and OTHER on top
+    hoverdata = human_labels(wide.to_numpy().ravel()).to_numpy().reshape(wide.shape)
+
+    colors = px.colors.qualitative.Prism
+    fig = go.Figure(data=[go.Scatter(x=wide.columns, y=wide.iloc[i], name=name, stackgroup='one', mode='lines', line=dict(width=0.5, color=colors[i % len(colors)]), customdata=hoverdata[i],
+                                     hovertemplate="%{fullData.name} <br> %{x}: %{customdata} </br><extra></extra>") for i, name in enumerate(wide.index)]) # Create plot
+    fig.update_xaxes(title_text="Fiscal Year", dtick=1) # Name x axis and label every year
+    fig.update_yaxes(title_text="Spending ($)") # Name y axis
+    fig.update_layout(height=600, font=dict(size=16), title=f'{agency_name} - Spending by {select}, {wide.columns.min()}-{wide.columns.max()}', title_x=0.5,
+                      legend=dict(yanchor="bottom", y=-0.6, xanchor="center", x=0.5, orientation="h")) # Set plot height, font size, title, move legend to bottom center, center title
+    return fig
+
+
+def league_figure(league, year):
+    """
+    This function builds the bar chart of the agencies that spent the most in a fiscal year.
+    Input: league (pd.Dataframe, results of league_frame), year (int)
+    Output: Plot (go.Figure)
+    """
+    top = league.head(TOP_N).iloc[::-1] # Largest at the top of the chart
+    labels = human_labels(top['Spending']) + ', ' + (top['Share'] * 100).round(1).astype(str).values + '% of total'
+    fig = go.Figure(data=[go.Bar(x=top['Spending'], y=top['Agency'], orientation='h', customdata=labels, hovertemplate="%{y} <br> %{customdata} </br><extra></extra>", marker=dict(color=px.colors.qualitative.Prism[0]))]) # Create plot
+    fig.update_xaxes(title_text="Spending ($)") # Name x axis
+    fig.update_layout(height=600, font=dict(size=16), title=f'Top {len(top)} Agencies by Spending, {year}', title_x=0.5) # Set plot height, font size, title, and center title
+    return fig
+
+
+def cached(agency, view, year, build, *args, version=None):
+    """
+    This function returns a figure from the shared figure cache, building and serializing it only on a miss. Figures expire on the same schedule as the responses they are drawn from.
+    Input: agency (string), view (string, e.g. 'subagency'), year (int, or None for views that span every year), build (function returning a go.Figure), args (arguments for build), version (revision of the data, so refreshed data gets a new figure)
+    Output: Plot (go.Figure)
+    """
+    key = (agency, view, year, version)
+    ttl = spend_cache.ttl_for(year or spend_cache.current_fiscal_year()) # Multi-year views include the open fiscal year
+    now = time.time()
+    with _lock:
+        hit = _figures.get(key)
+        if hit is not None and now - hit[0] <= ttl:
+            _figures.move_to_end(key) # Mark as recently used
+            spec = hit[1]
+        else:
+            spec = None
+    spend_metrics.count('figures.miss' if spec is None else 'figures.hit')
+    if spec is None:
+        with spend_metrics.timer('figure',view=view):
+            spec = build(*args).to_json()
+        with _lock:
+            _figures[key] = (now, spec)
+            while len(_figures) > MAX_FIGURES: # Drop the least recently used figures
+                _figures.popitem(last=False)
+    return go.Figure(json.loads(spec))
+
+
+def clear():
+    """
+    This function empties the shared figure cache.
+    Input: None
+    Output: None
+    """
+    with _lock:
+        _figures.clear()
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import logging
+import threading
+import functools
+import contextlib
+from collections import deque, Counter
+import pandas as pd
+
+
+#### Settings
+
+LOG_PATH = os.environ.get('SPENDAPP_METRICS_LOG') # Optional file that receives every event as one JSON line
+MAX_EVENTS = int(os.environ.get('SPENDAPP_METRICS_MAX_EVENTS', 10000)) # Most recent events kept in memory for the debug panel
+
+logger = logging.getLogger('spendapp.metrics') # Every event is also logged here as JSON, at debug level
+
+_events = deque(maxlen=MAX_EVENTS) # Recent events, oldest first
+_counts = Counter() # Running totals, e.g. cache hits and misses
+_lock = threading.Lock() # Requests finish on the client thread while sessions render on their own threads
+_missed = {} # Thread id -> whether each cached function body ran on the current calls, innermost last, see mark_miss()
+
+
+#### Functions
+
+def record(kind, **fields):
+    """
+    This function stores one event and writes it out as a JSON log line.
+    Input: kind (string, e.g. 'request' or 'stage'), fields (values to store with the event)
+    Output: None
+    """
+    event = dict(time=time.time(), kind=kind, **fields)
+    line = json.dumps(event, default=str)
+    with _lock:
+        _events.append(event)
+        if LOG_PATH:
+            with open(LOG_PATH, 'a') as f:
+                f.write(line + '\n')
+    logger.debug(line)
+
+
+def count(name, n=1):
+    """
+    This function adds to a running total.
+    Input: name (string, e.g. 'fetch.cache'), n (int)
+    Output: None
+    """
+    with _lock:
+        _counts[name] += n
+
+
+@contextlib.contextmanager
+def timer(stage, **fields):
+    """
+    This function times the code inside a with block and records it as a stage event. It works inside coroutines too.
+    Input: stage (string), fields (values to store with the event)
+    Output: Context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record('stage', stage=stage, seconds=time.perf_counter() - start, **fields)
+
+
+def mark_miss():
+    """
+    This function is called from inside an st.cache function body, which only runs on a cache miss. Only plain dicts and builtins are touched here, because st.cache hashes everything the body refers to.
+    Input: None
+    Output: None
+    """
+    stack = _missed.get(threading.get_ident())
+    if stack: # Only the innermost counted call missed; a cached function may call another one
+        stack[-1] = True
+
+
+def cache_counter(name):
+    """
+    This function returns a decorator that counts st.cache hits and misses. Put it above @st.cache and call mark_miss() in the function body.
+    Input: name (string, used as '<name>.hit' and '<name>.miss')
+    Output: Decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            ident = threading.get_ident()
+            stack = _missed.setdefault(ident, [])
+            stack.append(False)
+            try:
+                with timer(name):
+                    value = func(*args, **kwargs)
+            finally:
+                missed = stack.pop()
+                if not stack:
+                    _missed.pop(ident, None)
+            count(f"{name}.{'miss' if missed else 'hit'}")
+            return value
+        return wrapper
+    return decorator
+
+
+def counts():
+    """
+    This function returns a copy of the running totals.
+    Input: None
+    Output: Totals by name (dict)
+    """
+    with _lock:
+        return dict(_counts)
+
+
+def events(kind=None):
+    """
+    This function returns the recent events as a table.
+    Input: kind (string, optional, e.g. 'request')
+    Output: Dataframe with one row per event (pd.Dataframe)
+    """
+    with _lock:
+        rows = [event for event in _events if kind is None or event['kind'] == kind]
+    return pd.DataFrame.from_records(rows)
+
+
+def clear():
+    """
+    This function forgets every stored event and total.
+    Input: None
+    Output: None
+    """
+    with _lock:
+        _events.clear()
+        _counts.clear()
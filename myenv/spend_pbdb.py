@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+#### Settings
+
+PBDB_PATH = os.environ.get('SPENDAPP_PBDB_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Clean_Data', 'pbdb.parquet')) # Budget Database totals written by py/Clean_PBDB.py
+COLUMNS = ['toptier_code', 'fiscal_year', 'amount'] # One row per Treasury Agency Code and fiscal year, sorted by both
+
+# USAspending toptier codes that cover more than one Treasury Agency Code. Any other code maps to itself
+TREASURY_CODES = {
+    '097': ['097', '017', '021', '057'], # Department of Defense: DoD-wide accounts, Navy, Army and Air Force
+}
+
+_index = None # In-process copy of the file: (modified time, {(treasury_code, fiscal_year): amount}, last actual year)
+
+
+#### Functions
+
+def _load():
+    """
+    This function reads the Budget Database totals into a lookup table, reusing the in-process copy until the file changes.
+    Input: None
+    Output: Amount by (Treasury Agency Code, fiscal year) (dict) and the last year of actuals (int), or None if the file has not been built
+    """
+    global _index
+    try:
+        mtime = os.path.getmtime(PBDB_PATH)
+    except OSError: # Clean_PBDB.py has not been run
+        return None
+    if _index is None or _index[0] != mtime:
+        table = pq.read_table(PBDB_PATH, columns=COLUMNS)
+        if b'last_actual_year' not in table.schema.metadata: # Built before estimates were marked, so rebuild it with Clean_PBDB.py --force
+            return None
+        last_actual = int(table.schema.metadata[b'last_actual_year'])
+        rows = table.to_pydict()
+        _index = (mtime, {key: amount for key, amount in zip(zip(rows['toptier_code'], rows['fiscal_year']), rows['amount']) if key[1] <= last_actual}, last_actual) # Budget-year estimates are left out
+    return _index[1:]
+
+
+def source_hash():
+    """
+    This function returns the content hash of the workbook the file was built from, without reading the rows.
+    Input: None
+    Output: SHA-256 hex digest (string), or None if the file has not been built
+    """
+    if not os.path.exists(PBDB_PATH):
+        return None
+    return pq.read_schema(PBDB_PATH).metadata.get(b'source_sha256', b'').decode() or None
+
+
+def last_actual_year():
+    """
+    This function returns the last fiscal year the Budget Database has actuals for. Later years in the workbook are estimates.
+    Input: None
+    Output: Fiscal year (int), or None if the file has not been built
+    """
+    loaded = _load()
+    return None if loaded is None else loaded[1]
+
+
+def frame(toptier_codes):
+    """
+    This function returns agencies' budget authority by fiscal year from the Budget Database, adding up every Treasury Agency Code an agency covers. Budget authority is what an agency may spend, not what it obligated, so this is a separate, offline measure and is never mixed into the USAspending frames.
+    Input: toptier_codes (list of USAspending CGAC codes)
+    Output: Dataframe with columns toptier_code, Fiscal Year and Budget Authority, one row per agency and year of actuals (pd.Dataframe)
+    """
+    loaded = _load()
+    rows = []
+    if loaded is not None:
+        index = loaded[0]
+        for code in toptier_codes:
+            treasury = TREASURY_CODES.get(str(code), [str(code)])
+            totals = {}
+            for (treasury_code, year), amount in index.items():
+                if treasury_code in treasury:
+                    totals[year] = totals.get(year, 0) + amount
+            rows.extend({'toptier_code': str(code), 'Fiscal Year': year, 'Budget Authority': amount} for year, amount in sorted(totals.items()))
+    df = pd.DataFrame.from_records(rows, columns=['toptier_code', 'Fiscal Year', 'Budget Authority'])
+    return df.astype({'Fiscal Year': 'int16', 'Budget Authority': 'float64'})
@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import pyarrow as pa
+
+
+#### Settings
+
+SHARED_PATH = os.environ.get('SPENDAPP_SHARED_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.spend_cache', 'shared')) # Folder of Arrow files shared by every worker process on the host
+MAX_FRAMES = int(os.environ.get('SPENDAPP_SHARED_MAX_FRAMES', 64)) # Most frames each process keeps mapped
+MAX_AGE = float(os.environ.get('SPENDAPP_SHARED_MAX_AGE', 24*60*60)) # Files not republished for a day are deleted; frames are rebuilt long before that
+
+_frames = OrderedDict() # In-process view of the files read most recently: name -> (file identity, published at, dataframe)
+_lock = threading.Lock()
+
+
+#### Functions
+
+def path_for(name):
+    """
+    This function returns the file that holds one shared frame.
+    Input: name (string, e.g. 'category_097')
+    Output: Path to the Arrow IPC file (string)
+    """
+    return os.path.join(SHARED_PATH, f'{name}.arrow')
+
+
+def _load(name):
+    """
+    This function maps a shared file into memory and converts it to a dataframe, reusing the in-process view until the file is replaced. Numeric columns point straight into the mapped file, so every process reading it shares the same pages.
+    Input: name (string)
+    Output: (published at, dataframe) (tuple), or None if the frame has not been published
+    """
+    path = path_for(name)
+    try:
+        stat = os.stat(path)
+    except OSError: # Not published yet, or deleted by prune
+        with _lock:
+            _frames.pop(name, None)
+        return None
+    identity = (stat.st_ino, stat.st_mtime_ns) # A new version is a new file, swapped in with os.replace
+    with _lock:
+        if name not in _frames or _frames[name][0] != identity:
+            with pa.memory_map(path) as source: # The mapping stays open for as long as the dataframe uses it, even after the file is replaced
+                table = pa.ipc.open_file(source).read_all()
+            _frames[name] = (identity, float(table.schema.metadata[b'published']), table.to_pandas(split_blocks=True))
+        _frames.move_to_end(name) # Mark as recently used
+        loaded = _frames[name][1:]
+        while len(_frames) > MAX_FRAMES: # Unmap the least recently used frames; sessions still using one keep it until they let go
+            _frames.popitem(last=False)
+        return loaded
+
+
+def read(name, since=0, max_age=None):
+    """
+    This function returns a shared frame if it is current. The dataframe is read-only: use assign or copy to change it.
+    Input: name (string), since (float, ignore copies published before this time), max_age (seconds, optional, ignore older copies)
+    Output: Dataframe (pd.Dataframe), or None if there is no current copy
+    """
+    loaded = _load(name)
+    if loaded is None:
+        return None
+    published, df = loaded
+    if published < since or (max_age is not None and time.time() - published > max_age):
+        return None
+    return df
+
+
+def version(name):
+    """
+    This function returns when the shared frame this process sees was published. Include it in keys for anything built from the frame.
+    Input: name (string)
+    Output: Publish time (float), or None if the frame has not been published
+    """
+    loaded = _load(name)
+    return None if loaded is None else loaded[0]
+
+
+def publish(name, df):
+    """
+    This function writes a frame for every worker process to map. The file is written under a temporary name and then swapped in, so readers see either the old version or the new one, never a half-written file.
+    Input: name (string), df (pd.Dataframe)
+    Output: The shared, read-only copy of df (pd.Dataframe), or df itself if the folder can't be written
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, published=repr(time.time())))
+    path = path_for(name)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp' # Several sessions may publish the same frame at once
+    try:
+        os.makedirs(SHARED_PATH, exist_ok=True)
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer: # Uncompressed, so it can be mapped without decoding
+            writer.write_table(table)
+        os.replace(tmp, path)
+    except OSError: # Read-only disk: keep the private copy
+        return df
+    prune()
+    return _load(name)[1]
+
+
+def prune():
+    """
+    This function deletes shared files that haven't been republished within MAX_AGE, e.g. compare combinations nobody has looked at since. A process that still needs one publishes it again.
+    Input: None
+    Output: None
+    """
+    cutoff = time.time() - MAX_AGE
+    for file in os.listdir(SHARED_PATH):
+        path = os.path.join(SHARED_PATH, file)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError: # Already deleted by another process
+            pass
+
+
+def clear():
+    """
+    This function deletes every shared frame. Processes that have one mapped keep their copy until they read it again.
+    Input: None
+    Output: None
+    """
+    with _lock:
+        _frames.clear()
+    if os.path.isdir(SHARED_PATH):
+        for file in os.listdir(SHARED_PATH):
+            os.remove(os.path.join(SHARED_PATH, file))
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+#### Settings
+
+STORE_PATH = os.environ.get('SPENDAPP_STORE_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Clean_Data', 'spend_store')) # Root folder of the local spending store
+
+# Columns kept for each endpoint. Nested 'children' lists are stored as JSON text.
+COLUMNS = {
+    'awards': ['toptier_code','fiscal_year','latest_action_date','transaction_count','obligations'],
+    'sub_agency': ['toptier_code','fiscal_year','name','abbreviation','total_obligations','transaction_count','new_award_count','children'],
+    'budget_function': ['toptier_code','fiscal_year','name','obligated_amount','gross_outlay_amount','children'],
+    'object_class': ['toptier_code','fiscal_year','name','obligated_amount','gross_outlay_amount'],
+}
+
+_partitions = {} # In-process copy of each partition read so far: (endpoint, year) -> (modified time, {toptier_code: rows})
+_lock = threading.Lock() # Reads run in the client's thread pool, so only one thread loads a partition
+
+
+#### Functions
+
+def partition_path(endpoint, fiscal_year):
+    """
+    This function returns the file that holds one endpoint and fiscal year for every agency.
+    Input: endpoint (string), fiscal_year (int)
+    Output: Path to the Parquet file (string)
+    """
+    return os.path.join(STORE_PATH, endpoint, f'fiscal_year={int(fiscal_year)}', 'part.parquet')
+
+
+def stored_agencies(endpoint, fiscal_year):
+    """
+    This function returns which agencies have been prefetched for an endpoint and fiscal year, without reading the rows.
+    Input: endpoint (string), fiscal_year (int)
+    Output: CGAC codes (set), empty if the partition does not exist
+    """
+    path = partition_path(endpoint, fiscal_year)
+    if not os.path.exists(path):
+        return set()
+    return set(json.loads(pq.read_schema(path).metadata[b'agencies']))
+
+
+def to_rows(endpoint, toptier_code, fiscal_year, data):
+    """
+    This function flattens one API response into store rows.
+    Input: endpoint (string), toptier_code (string), fiscal_year (int), data (dict, parsed JSON response)
+    Output: Rows for the store (list of dicts)
+    """
+    if endpoint == 'awards':
+        items = [data] # The awards endpoint returns a single record per year
+    else:
+        items = data['results']
+    rows = []
+    for item in items:
+        row = {col: item.get(col) for col in COLUMNS[endpoint]}
+        row['toptier_code'] = str(toptier_code)
+        row['fiscal_year'] = int(fiscal_year)
+        if 'children' in row:
+            row['children'] = json.dumps(item.get('children') or [])
+        rows.append(row)
+    return rows
+
+
+def age(endpoint, fiscal_year):
+    """
+    This function returns how long ago one endpoint and fiscal year was last written to the store.
+    Input: endpoint (string), fiscal_year (int)
+    Output: Seconds (float), or None if it has not been prefetched
+    """
+    try:
+        return time.time() - os.path.getmtime(partition_path(endpoint, fiscal_year))
+    except OSError: # Not prefetched
+        return None
+
+
+def read_partition(endpoint, fiscal_year):
+    """
+    This function reads one endpoint and fiscal year from the store.
+    Input: endpoint (string), fiscal_year (int)
+    Output: Dataframe of rows (pd.Dataframe), CGAC codes the partition covers (set), or (None, None) if it has not been prefetched
+    """
+    path = partition_path(endpoint, fiscal_year)
+    if not os.path.exists(path):
+        return None, None
+    table = pq.read_table(path)
+    agencies = set(json.loads(table.schema.metadata[b'agencies'])) # Agencies that were fetched, including ones with no rows
+    return table.to_pandas(), agencies
+
+
+def write_partition(endpoint, fiscal_year, rows, agencies):
+    """
+    This function writes one endpoint and fiscal year to the store. Rows already stored for agencies that were not re-pulled are kept. The file is written under a temporary name and then swapped in, so readers never see a half-written partition.
+    Input: endpoint (string), fiscal_year (int), rows (list of dicts from to_rows), agencies (CGAC codes that were fetched successfully)
+    Output: None
+    """
+    path = partition_path(endpoint, fiscal_year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS[endpoint])
+    agencies = set(agencies)
+    old, old_agencies = read_partition(endpoint, fiscal_year)
+    if old is not None:
+        df = pd.concat([old[~old['toptier_code'].isin(agencies)], df], ignore_index=True) # Keep agencies that weren't re-pulled
+        agencies |= old_agencies
+    df = df.sort_values('toptier_code', kind='stable') # Keep each agency's rows together
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, agencies=json.dumps(sorted(agencies))))
+    tmp = f'{path}.tmp'
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def _load_partition(endpoint, fiscal_year):
+    """
+    This function reads a partition and groups its rows by agency, reusing the in-process copy until the file changes.
+    Input: endpoint (string), fiscal_year (int)
+    Output: Rows grouped by CGAC code for every agency the partition covers (dict), or None if the partition has not been prefetched
+    """
+    path = partition_path(endpoint, fiscal_year)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError: # Not prefetched
+        return None
+    key = (endpoint, int(fiscal_year))
+    with _lock:
+        if key not in _partitions or _partitions[key][0] != mtime:
+            df, agencies = read_partition(endpoint, fiscal_year)
+            df = df.astype(object).where(df.notna(), None) # Use None for missing values, like the API does
+            grouped = {code: [] for code in agencies}
+            grouped.update({code: group.to_dict('records') for code, group in df.groupby('toptier_code', sort=False)})
+            _partitions[key] = (mtime, grouped)
+        return _partitions[key][1]
+
+
+def get(endpoint, toptier_code, fiscal_year):
+    """
+    This function rebuilds an API response from the store, so callers can use it in place of a live request.
+    Input: endpoint (string), toptier_code (string), fiscal_year (int)
+    Output: Response in the same shape as the API (dict), or None if the agency has not been prefetched for this year or has no awards record
+    """
+    partition = _load_partition(endpoint, fiscal_year)
+    if partition is None or str(toptier_code) not in partition: # Not prefetched for this agency
+        return None
+    rows = partition[str(toptier_code)]
+    if 'children' in COLUMNS[endpoint]:
+        rows = [dict(row, children=json.loads(row['children'] or '[]')) for row in rows]
+    if endpoint == 'awards':
+        return rows[0] if rows else None
+    return {'toptier_code': str(toptier_code), 'fiscal_year': int(fiscal_year), 'results': rows}
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import types
+import tempfile
+import argparse
+import functools
+import statistics
+import concurrent.futures
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'myenv')
+sys.path.insert(0, APP_DIR) # Benchmark the app's own code
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Stub_Server
+
+
+#### Functions
+
+def percentile(values, q):
+    """
+    This function returns a percentile of a list of timings.
+    Input: values (list of floats), q (float between 0 and 1)
+    Output: Percentile (float)
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def timed(func, *args):
+    """
+    This function runs a function once and returns how long it took.
+    Input: func (function), args (arguments for func)
+    Output: Seconds (float)
+    """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def sections(app, spend_client, spend_figures):
+    """
+    This function returns the app's sections as plain functions of an agency code: the data pull plus the figure each one draws.
+    Input: app (spend_app module), spend_client (module), spend_figures (module)
+    Output: Section functions by name (dict)
+    """
+    def agency_load(code):
+        df = spend_client.run(app.async_func(code, 'category'))
+        spend_figures.subagency_figure(df, code).to_json()
+
+    def compare(code):
+        h = spend_client.run(app.async_func_many([code, f'{code}c'], 'historical'))
+        spend_figures.compare_figure(h.assign(Agency=h['toptier_code']), code).to_json()
+
+    def breakdown(code):
+        for (year, breakdown), b in spend_client.run(app.breakdown_all(code)).items():
+            spend_figures.breakdown_figure(b, code, breakdown, year).to_json()
+
+    def trend(code):
+        t, failed = spend_client.run(app.breakdown_trend(code, 'object_class/'))
+        spend_figures.trend_figure(t, code, 'Object Class').to_json()
+
+    return {'agency load': agency_load, 'compare': compare, 'breakdown': breakdown, 'trend': trend}
+
+
+def v1_historical(base_url):
+    """
+    This function returns Version 1's sequential historical() with its requests sent to the stand-in server. The st.cache wrapper is skipped so every call is cold. Version 1 uses st.cache and DataFrame.append, which newer Streamlit and pandas releases removed, so stand-ins are installed first where they are missing.
+    Input: base_url (string)
+    Output: Function of an agency code
+    """
+    import requests
+    import pandas as pd
+    import streamlit as st
+    if not hasattr(st, 'cache'): # No-op decorator that keeps __wrapped__ like st.cache does
+        st.cache = lambda *args, **kwargs: (lambda func: functools.wraps(func)(lambda *a, **k: func(*a, **k)))
+    if not hasattr(pd.DataFrame, 'append'):
+        pd.DataFrame.append = lambda self, other, ignore_index=False: pd.concat([self, other], ignore_index=ignore_index)
+    import spend_app_v1
+    spend_app_v1.requests = types.SimpleNamespace(get=lambda url, **kwargs: requests.get(url.replace('https://api.usaspending.gov', base_url), **kwargs)) # Version 1 hardcodes the API host
+    return spend_app_v1.historical.__wrapped__
+
+
+def run(args):
+    """
+    This function starts the stand-in server, points the app at it with an empty cache and store, and times each section cold (first request for an agency) and warm (same agency again, served from the response cache).
+    Input: args (parsed command line arguments)
+    Output: Results (dict)
+    """
+    base_url = Stub_Server.start(args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, size=args.size, seed=0)
+    scratch = tempfile.mkdtemp(prefix='spend_bench_')
+    os.environ['SPENDAPP_API_URL'] = base_url
+    os.environ['SPENDAPP_CACHE_PATH'] = os.path.join(scratch, 'responses.sqlite3')
+    os.environ['SPENDAPP_STORE_PATH'] = os.path.join(scratch, 'store') # Empty, so every cold run goes to the server
+    import spend_app as app # Settings are read at import, so import after the environment is set
+    import spend_client
+    import spend_figures
+
+    codes = (f'{i:03d}' for i in range(100, 1000)) # A fresh agency code per cold run, so nothing is cached yet
+    results = {'config': vars(args), 'sections': {}}
+    for name, section in sections(app, spend_client, spend_figures).items():
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            code = next(codes)
+            cold.append(timed(section, code))
+            warm.append(timed(section, code))
+        results['sections'][name] = {'cold': statistics.median(cold), 'warm': statistics.median(warm)}
+    report_sections(results) # Shown before the Version 1 comparison, so a failure there doesn't lose them
+
+    results['historical'] = {'async_func': statistics.median(timed(lambda code: spend_client.run(app.async_func(code, 'historical')), next(codes)) for _ in range(args.repeat))}
+    try:
+        historical = v1_historical(base_url)
+        results['historical']['v1 sequential'] = statistics.median(timed(historical, next(codes)) for _ in range(args.repeat))
+    except Exception as e: # Version 1 can't run in this environment; keep the rest of the results
+        results['historical']['v1 error'] = repr(e)
+
+    agency_load = sections(app, spend_client, spend_figures)['agency load']
+    batch = [next(codes) for _ in range(args.sessions)]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.sessions) as pool: # Streamlit runs each session in its own thread
+        latencies = list(pool.map(lambda code: timed(agency_load, code), batch))
+    wall = time.perf_counter() - start
+    results['sessions'] = {'sessions': args.sessions, 'seconds': wall, 'sessions_per_second': args.sessions / wall,
+                           'p50': percentile(latencies, 0.5), 'p95': percentile(latencies, 0.95)}
+    return results
+
+
+def report_sections(results):
+    """
+    This function prints the section timings as a table.
+    Input: results (dict, from run)
+    Output: None
+    """
+    print(f"{'section':<16}{'cold (s)':>10}{'warm (s)':>10}")
+    for name, t in results['sections'].items():
+        print(f"{name:<16}{t['cold']:>10.3f}{t['warm']:>10.3f}")
+    print()
+
+
+def report(results):
+    """
+    This function prints the Version 1 comparison and the concurrent sessions results. The section timings are printed by run as soon as they are in.
+    Input: results (dict, from run)
+    Output: None
+    """
+    h = results['historical']
+    print(f"historical, {'async_func':<14}{h['async_func']:>8.3f} s")
+    if 'v1 sequential' in h:
+        print(f"historical, {'v1 sequential':<14}{h['v1 sequential']:>8.3f} s")
+        print(f"asyncio speedup: {h['v1 sequential'] / h['async_func']:.1f}x")
+    else:
+        print(f"Version 1 could not run: {h['v1 error']}")
+    print()
+    s = results['sessions']
+    print(f"{s['sessions']} concurrent sessions: {s['sessions_per_second']:.2f} sessions/s, p50 {s['p50']:.3f} s, p95 {s['p95']:.3f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the app against a local stand-in for the USAspending API.')
+    parser.add_argument('--port', type=int, default=Stub_Server.PORT)
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Up to this many extra seconds, chosen at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+    parser.add_argument('--size', type=int, default=10, help='Subagencies, components and breakdown rows per year')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (the median is reported)')
+    parser.add_argument('--sessions', type=int, default=20, help='Simulated sessions loading an agency at once')
+    parser.add_argument('--json', help='Append the results to this file as one JSON line, to track them over time')
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(dict(results, time=time.time())) + '\n')
@@ -0,0 +1,26 @@
+import os
+import json
+import pandas as pd
+
+
+CLEAN_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Clean_Data')
+
+
+def build_catalog(source=os.path.join(CLEAN_DATA, 'CGAC_list.xlsx'), target=os.path.join(CLEAN_DATA, 'CGAC_list.json')):
+    """
+    This function converts the cleaned CGAC list into the JSON catalog the Spend App ships with, so the app never has to download or parse the Excel file. Run it after Clean_CGAC or Get_Links updates CGAC_list.xlsx.
+    Input: source (path to CGAC_list.xlsx), target (path to CGAC_list.json)
+    Output: Number of agencies written (int)
+    """
+    df = pd.read_excel(source)
+    df = df.dropna(subset=['CGAC']) # Remove the blank first row, the app adds its own
+    df['CGAC'] = df['CGAC'].astype(int).astype(str).str.zfill(3) # Restore leading zeros lost in Excel
+    df = df.fillna('')
+    records = df[['CGAC','AGENCY NAME','OTHER NAME','Link','Description','Website']].to_dict('records')
+    with open(target, 'w') as f:
+        f.write('[\n' + ',\n'.join(json.dumps(r, ensure_ascii=False) for r in records) + '\n]\n') # One agency per line keeps diffs readable
+    return len(records)
+
+
+if __name__ == "__main__":
+    print(f'Wrote {build_catalog()} agencies')
@@ -0,0 +1,148 @@
+import os
+import sys
+import html
+import json
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'myenv')) # Reuse the app's API client and figures
+import plotly.offline
+import spend_cache
+import spend_catalog
+import spend_client
+import spend_figures
+
+
+OUT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Reports') # One folder per run, named by date
+BREAKDOWNS = {'budget_function': 'Budget Function', 'object_class': 'Object Class'} # Endpoint -> label used in the pie chart title
+CONCURRENCY = 10 # Agencies fetched at once; each one sends about 40 requests
+
+
+#### Functions
+
+async def fetch_agency(app, code, compare, year):
+    """
+    This function pulls everything one agency's report needs in one concurrent batch: subagency spending and award history for every year, and both breakdowns for one year.
+    Input: app (spend_app module), code (string), compare (CGAC codes drawn next to it in the line chart), year (int, breakdown year)
+    Output: Category and historical results of fetch_frame (frame and failed years), then one breakdown frame per BREAKDOWNS entry (list), with None for any that failed
+    """
+    codes = [code] + [c for c in compare if c != code]
+    return await spend_client.gather([app.fetch_frame([code], 'category'), app.fetch_frame(codes, 'historical')] +
+                                     [app.fetch_breakdown(code, year, f'{breakdown}/') for breakdown in BREAKDOWNS], timeout=None)
+
+
+def views(app, code, names, compare, year, frames):
+    """
+    This function lists the figures of one agency's report: the subagency bar chart, the compare line chart and a breakdown pie chart per BREAKDOWNS entry.
+    Input: app (spend_app module), code (string), names (dict, agency name by CGAC code), compare (list of CGAC codes), year (int), frames (list from fetch_agency, or None)
+    Output: (view, figure builder, arguments for it or None if there is no data, (CGAC code, fiscal year) pairs missing from it) (list of tuples)
+    """
+    frames = frames or [None] * (2 + len(BREAKDOWNS))
+    (category, category_failed), (h, h_failed), breakdowns = frames[0] or (None, []), frames[1] or (None, []), frames[2:]
+    name = names.get(code, code)
+    shown = {c: names.get(c, c) for c in [code] + compare} # Selected agency first, like the app
+    result = [('subagency', spend_figures.subagency_figure, None if category is None or category.shape[0] == 0 else (category, name), category_failed)]
+    if h is None or code not in set(h['toptier_code']):
+        result.append(('compare', spend_figures.compare_figure, None, h_failed))
+    else:
+        result.append(('compare', spend_figures.compare_figure, (h.assign(Agency=h['toptier_code'].astype(str).map(shown)), app.compare_title(shown)), h_failed))
+    for (breakdown, label), b in zip(BREAKDOWNS.items(), breakdowns):
+        result.append((breakdown, spend_figures.breakdown_figure, None if b is None or b.shape[0] == 0 else (b, name, label, year), []))
+    return result
+
+
+def render(path, fmt, note, build, *args):
+    """
+    This function builds one figure and writes it out. It runs in a worker process, so building and serializing figures uses every core.
+    Input: path (string), fmt (string, 'html' or 'json'), note (string shown under the title, e.g. missing fiscal years, or None), build (figure builder from spend_figures), args (arguments for build)
+    Output: Seconds taken (float)
+    """
+    start = time.perf_counter()
+    fig = build(*args)
+    if note:
+        fig.update_layout(title_text=f'{fig.layout.title.text}<br><sup>{html.escape(note)}</sup>')
+    text = fig.to_html(include_plotlyjs='directory', full_html=True) if fmt == 'html' else fig.to_json() # HTML pages share one copy of plotly.min.js
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+    return time.perf_counter() - start
+
+
+def write_index(out, manifest, year, fmt):
+    """
+    This function writes manifest.json, listing every agency's files, missing views and fiscal years missing from its charts, and for HTML reports an index page linking to them.
+    Input: out (string, output folder), manifest (dict, entry by CGAC code), year (int), fmt (string)
+    Output: None
+    """
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'breakdown_year': year, 'format': fmt, 'agencies': manifest}, f, indent=1)
+    if fmt == 'html':
+        rows = []
+        for code, entry in manifest.items():
+            links = ' '.join(f'<a href="{html.escape(file)}">{view}</a>' + ('*' if view in entry['failed_years'] else '') for view, file in sorted(entry['files'].items())) # * marks charts with missing years
+            rows.append(f'<tr><td>{code}</td><td>{html.escape(entry["name"])}</td><td>{links}</td></tr>')
+        with open(os.path.join(out, 'index.html'), 'w') as f:
+            f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>SpendApp reports</title></head><body><h1>Agency spending reports</h1><p>Breakdowns are for fiscal year {year}. Charts marked * are missing fiscal years that could not be loaded.</p><table>{"".join(rows)}</table></body></html>')
+
+
+def build_reports(app, codes, names, compare, year, fmt, out, workers=None, concurrency=CONCURRENCY):
+    """
+    This function writes every agency's report. Agencies are fetched concurrently on the shared event loop, and each agency's figures are handed to a process pool as soon as its data is in, so fetching and rendering overlap.
+    Input: app (spend_app module), codes (list of CGAC codes), names (dict, agency name by CGAC code), compare (list of CGAC codes), year (int), fmt (string, 'html' or 'json'), out (string, output folder), workers (int, defaults to one per core), concurrency (int, agencies fetched at once)
+    Output: Manifest entry by CGAC code (dict)
+    """
+    os.makedirs(out, exist_ok=True)
+    if fmt == 'html':
+        with open(os.path.join(out, 'plotly.min.js'), 'w') as f:
+            f.write(plotly.offline.get_plotlyjs())
+    manifest = {}
+    jobs = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool: # spawn, since the event loop thread is already running
+        for position, frames in spend_client.stream([fetch_agency(app, code, compare, year) for code in codes], limit=concurrency, timeout=None):
+            code = codes[position]
+            manifest[code] = {'name': names.get(code, code), 'files': {}, 'missing': [], 'failed_years': {}}
+            for view, build, args, failed in views(app, code, names, compare, year, frames):
+                if failed: # Years whose requests failed, noted on the chart and in the manifest
+                    manifest[code]['failed_years'][view] = [list(pair) for pair in failed]
+                if args is None: # No data, or every request failed
+                    manifest[code]['missing'].append(view)
+                    continue
+                file = f'{code}_{view}.{fmt}'
+                note = app.failed_note(failed, {c: names.get(c, c) for c in ([code] + compare if view == 'compare' else [code])}) if failed else None # Name the agencies when the chart has several
+                jobs[pool.submit(render, os.path.join(out, file), fmt, note, build, *args)] = (code, view, file)
+        for future in concurrent.futures.as_completed(jobs):
+            code, view, file = jobs[future]
+            try:
+                future.result()
+                manifest[code]['files'][view] = file
+            except Exception as e:
+                manifest[code]['missing'].append(view)
+                print(f'{code} {view}: {e!r}')
+    manifest = {code: manifest[code] for code in codes if code in manifest} # Catalog order
+    write_index(out, manifest, year, fmt)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write the app\'s subagency, compare and breakdown charts for every agency in the CGAC list as static HTML or JSON files, without a Streamlit session.')
+    parser.add_argument('--agency', action='append', help='CGAC code to report on (default: every agency in CGAC_list.json)')
+    parser.add_argument('--compare', action='append', default=[], help='CGAC code drawn next to every agency in the compare chart')
+    parser.add_argument('--year', type=int, help='Fiscal year of the breakdown charts (default: the last closed year with published data)')
+    parser.add_argument('--format', choices=['html', 'json'], default='html')
+    parser.add_argument('--out', help=f'Output folder (default: {OUT_PATH}/<date>)')
+    parser.add_argument('--workers', type=int, help='Processes building figures (default: one per core)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Agencies fetched at once')
+    args = parser.parse_args()
+
+    import spend_app as app # Imported here so worker processes only load the figure code
+    names = spend_catalog.agency_names(app.CATALOG_PATH)
+    codes = list(dict.fromkeys(args.agency or names)) # Unique codes, in the order given
+    year = args.year or min(spend_client.run(spend_client.latest_fiscal_year()), spend_cache.current_fiscal_year() - 1) # Same default as the app's year slider
+    out = args.out or os.path.join(OUT_PATH, time.strftime('%Y-%m-%d'))
+
+    start = time.perf_counter()
+    manifest = build_reports(app, codes, names, args.compare, year, args.format, out, args.workers, args.concurrency)
+    files = sum(len(entry['files']) for entry in manifest.values())
+    print(f'Wrote {files} figures for {len(manifest)} agencies to {out} in {time.perf_counter() - start:.1f} s')
@@ -1,10 +1,122 @@
-import pandas as pd
-import numpy as np
+import os
+import re
 import sys
+import hashlib
+import argparse
 import requests
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'myenv')) # Write where the app reads
+import spend_pbdb
+
 
 url = 'https://www.govinfo.gov/content/pkg/BUDGET-2023-DB/xls/BUDGET-2023-DB-1.xlsx' # Store link
-r = requests.get(url) # Make request
-open('temp.xlsx', 'wb').write(r.content) # Store results in a temporary file
-df = pd.read_excel('temp.xlsx') # Read in as df
-df
\ No newline at end of file
+LAST_ACTUAL_YEAR = int(re.search(r'BUDGET-(\d{4})', url).group(1)) - 2 # The budget's own year and the year before it are estimates
+SOURCE = 'temp.xlsx' # Downloaded workbook
+CHUNK_ROWS = 2000 # Worksheet rows normalized at a time
+DOWNLOAD_CHUNK = 1024*1024 # Bytes written at a time while downloading
+
+
+def download(url, path):
+    """
+    This function streams the workbook to disk instead of holding the whole response in memory.
+    Input: url (string), path (string)
+    Output: None
+    """
+    with requests.get(url, stream=True) as r: # Make request
+        r.raise_for_status()
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in r.iter_content(DOWNLOAD_CHUNK):
+                f.write(chunk)
+    os.replace(path + '.tmp', path)
+
+
+def file_hash(path):
+    """
+    This function returns the content hash of a file, read a block at a time.
+    Input: path (string)
+    Output: SHA-256 hex digest (string)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_chunks(path):
+    """
+    This function reads the first worksheet row by row in read-only mode, so only CHUNK_ROWS rows are in memory at a time.
+    Input: path (string)
+    Output: Generator of dataframes with the worksheet's header as columns (pd.Dataframe)
+    """
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows))
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == CHUNK_ROWS:
+                yield pd.DataFrame.from_records(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=header)
+    finally:
+        wb.close()
+
+
+def normalize(chunk):
+    """
+    This function turns a chunk of accounts (one column per year) into totals by agency and fiscal year. Agencies are keyed by Treasury Agency Code, which spend_pbdb.TREASURY_CODES maps to USAspending toptier codes, and amounts are converted from thousands of dollars to dollars. The transition quarter (TQ) is left out.
+    Input: chunk (pd.Dataframe from read_chunks)
+    Output: Totals with columns toptier_code, fiscal_year and amount (pd.Dataframe)
+    """
+    years = [col for col in chunk.columns if isinstance(col, int) or str(col).isdigit()]
+    codes = chunk['Treasury Agency Code'].astype(str).str.strip()
+    chunk = chunk.loc[codes.str.isdigit(), years] # Skip rows with no agency, e.g. undistributed receipts
+    chunk.index = codes[codes.str.isdigit()].str.zfill(3)
+    long = chunk.apply(pd.to_numeric, errors='coerce').stack().rename('amount').reset_index() # One row per account and year
+    long.columns = ['toptier_code', 'fiscal_year', 'amount']
+    long['fiscal_year'] = long['fiscal_year'].astype(int)
+    return long.groupby(['toptier_code', 'fiscal_year'], as_index=False)['amount'].sum()
+
+
+def build(source, target, digest):
+    """
+    This function normalizes the workbook chunk by chunk and writes the totals sorted by agency and year. Estimate years after LAST_ACTUAL_YEAR are left out. Row groups hold one slice of agencies each, so readers can filter on toptier_code without scanning the whole file.
+    Input: source (path to the workbook), target (path to the Parquet file), digest (content hash of the workbook)
+    Output: Number of rows written (int)
+    """
+    totals = None
+    for chunk in read_chunks(source):
+        part = normalize(chunk)
+        totals = part if totals is None else pd.concat([totals, part]).groupby(['toptier_code', 'fiscal_year'], as_index=False)['amount'].sum() # Keep a running total, never the raw rows
+    totals = totals[totals['fiscal_year'] <= LAST_ACTUAL_YEAR].sort_values(['toptier_code', 'fiscal_year'], ignore_index=True)
+    totals['amount'] = totals['amount'] * 1000 # Workbook amounts are in thousands of dollars
+    table = pa.Table.from_pandas(totals[spend_pbdb.COLUMNS], preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, source_sha256=digest, source_url=url, last_actual_year=str(LAST_ACTUAL_YEAR)))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    pq.write_table(table, target + '.tmp', row_group_size=1024)
+    os.replace(target + '.tmp', target)
+    return table.num_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the Budget Database workbook into the totals file the app can use offline.')
+    parser.add_argument('--source', help='Use a workbook already on disk instead of downloading it')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the workbook has not changed')
+    args = parser.parse_args()
+
+    source = args.source or SOURCE
+    if not args.source:
+        download(url, source)
+    digest = file_hash(source)
+    if not args.force and digest == spend_pbdb.source_hash():
+        print(f'{source} has not changed, nothing to do')
+    else:
+        rows = build(source, spend_pbdb.PBDB_PATH, digest)
+        print(f'Wrote {rows} rows to {spend_pbdb.PBDB_PATH}')
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'myenv')) # Reuse the app's API client and store
+import spend_cache
+import spend_catalog
+import spend_client
+import spend_store
+
+
+FIRST_YEAR = {'awards': spend_client.FIRST_YEAR, 'sub_agency': spend_client.FIRST_YEAR, 'budget_function': spend_client.BREAKDOWN_FIRST_YEAR, 'object_class': spend_client.BREAKDOWN_FIRST_YEAR} # First fiscal year the app shows for each endpoint
+
+
+def closed_since(year):
+    """
+    This function returns when a fiscal year closed. Federal fiscal years end on September 30th.
+    Input: year (int)
+    Output: Unix time of October 1st of the year (float)
+    """
+    return time.mktime(datetime.date(int(year), 10, 1).timetuple())
+
+
+async def fetch_partition(endpoint, year, codes):
+    """
+    This function pulls one endpoint and fiscal year for every agency concurrently.
+    Input: endpoint (string), year (int), codes (list of CGAC codes)
+    Output: Rows for the store (list of dicts), CGAC codes that were fetched successfully (list)
+    """
+    results = await spend_client.gather([spend_client.fetch_live(endpoint, code, year) for code in codes], timeout=None)
+    rows = []
+    fetched = []
+    for code, data in zip(codes, results):
+        if data is not None: # Failed agencies are left out, so the app falls back to the API for them
+            rows.extend(spend_store.to_rows(endpoint, code, year, data))
+            fetched.append(code)
+    return rows, fetched
+
+
+def prefetch(codes, endpoints, full=False):
+    """
+    This function fills the local spending store. Closed fiscal years that are already stored are skipped, so later runs only re-pull the open fiscal year unless full is set. A year that was still open when it was stored is re-pulled once after it closes, since its last periods are only published then.
+    Input: codes (list of CGAC codes), endpoints (list of strings), full (bool, re-pull every year)
+    Output: None
+    """
+    open_year = spend_cache.current_fiscal_year()
+    for endpoint in endpoints:
+        for year in spend_client.run(spend_client.fiscal_years(FIRST_YEAR[endpoint])): # Up to the latest year with published data
+            age = spend_store.age(endpoint, year)
+            if not full and year < open_year and age is not None and time.time() - age >= closed_since(year) and spend_store.stored_agencies(endpoint, year) >= set(codes): # Closed years stored after they closed don't change
+                continue
+            rows, fetched = spend_client.run(fetch_partition(endpoint, year, codes))
+            spend_store.write_partition(endpoint, year, rows, fetched)
+            print(f'{endpoint} {year}: {len(rows)} rows, {len(codes)-len(fetched)} failed requests')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Prefetch USAspending data for every agency in the CGAC list into the local spending store.')
+    parser.add_argument('--endpoint', action='append', choices=list(FIRST_YEAR), help='Endpoint to prefetch (default: all)')
+    parser.add_argument('--agency', action='append', help='CGAC code to prefetch (default: every agency in CGAC_list.json)')
+    parser.add_argument('--full', action='store_true', help='Re-pull closed fiscal years that are already stored')
+    args = parser.parse_args()
+
+    prefetch(args.agency or list(spend_catalog.agency_names()), args.endpoint or list(FIRST_YEAR), full=args.full)
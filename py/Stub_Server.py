@@ -0,0 +1,96 @@
+import random
+import asyncio
+import argparse
+import threading
+from aiohttp import web
+
+
+#### Settings
+
+PORT = 8765 # Default port for the stand-in server
+
+
+#### Functions
+
+def make_app(latency=0.1, jitter=0.05, error_rate=0.0, size=10, latest=2022, seed=None):
+    """
+    This function builds a stand-in for the USAspending endpoints the app calls (awards, sub_agency, budget_function, object_class and submission_periods). Responses have the same shape as the real API, with made-up numbers.
+    Input: latency (seconds added to every response), jitter (up to this many extra seconds, chosen at random), error_rate (share of requests answered with a 503), size (subagencies, components per subagency and breakdown rows per year), latest (latest fiscal year with published data), seed (int, optional)
+    Output: Server application (aiohttp.web.Application)
+    """
+    rng = random.Random(seed)
+
+    async def delay():
+        await asyncio.sleep(latency + rng.uniform(0, jitter))
+        if rng.random() < error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    def page(request, results):
+        number = int(request.query.get('page', 1))
+        limit = int(request.query.get('limit', 10))
+        return {'page_metadata': {'page': number, 'limit': limit, 'total': len(results), 'hasNext': number * limit < len(results)},
+                'results': results[(number - 1) * limit:number * limit]}
+
+    async def awards(request):
+        await delay()
+        year = int(request.query['fiscal_year'])
+        return web.json_response({'toptier_code': request.match_info['code'], 'fiscal_year': year, 'latest_action_date': f'{year}-09-30T00:00:00', 'transaction_count': 1000 + year, 'obligations': 1e9 * (1 + year % 7), 'messages': []})
+
+    async def sub_agency(request):
+        await delay()
+        year = int(request.query['fiscal_year'])
+        results = [{'name': f'Subagency {i}', 'abbreviation': f'S{i}', 'total_obligations': 1e8 * (i + 1) + year, 'transaction_count': 10 * i, 'new_award_count': i,
+                    'children': [{'name': f'Office {i}-{j}', 'code': f'{i:02d}{j:02d}', 'total_obligations': 1e6 * (j + 1), 'transaction_count': j, 'new_award_count': j} for j in range(size)]}
+                   for i in range(size)]
+        return web.json_response(page(request, results))
+
+    async def breakdown(request):
+        await delay()
+        year = int(request.query['fiscal_year'])
+        results = [{'name': f'Category {i}', 'obligated_amount': 1e7 * (i + 1) + year, 'gross_outlay_amount': 1e7 * i, 'children': []} for i in range(size)]
+        return web.json_response(page(request, results))
+
+    async def submission_periods(request):
+        return web.json_response({'available_periods': [{'submission_fiscal_year': year, 'submission_fiscal_month': 12, 'submission_reveal_date': f'{year}-11-15T00:00:00Z'} for year in range(2017, latest + 1)]})
+
+    app = web.Application()
+    app.router.add_get('/api/v2/agency/{code}/awards/', awards)
+    app.router.add_get('/api/v2/agency/{code}/sub_agency/', sub_agency)
+    app.router.add_get('/api/v2/agency/{code}/budget_function/', breakdown)
+    app.router.add_get('/api/v2/agency/{code}/object_class/', breakdown)
+    app.router.add_get('/api/v2/references/submission_periods/', submission_periods)
+    return app
+
+
+def start(port=PORT, **config):
+    """
+    This function runs the stand-in server in a background thread and waits until it accepts requests.
+    Input: port (int), config (arguments for make_app)
+    Output: Base URL of the server (string)
+    """
+    ready = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(make_app(**config), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name='stub-server', daemon=True).start()
+    ready.wait()
+    return f'http://127.0.0.1:{port}'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a stand-in for the USAspending agency endpoints. Point the app at it with SPENDAPP_API_URL=http://127.0.0.1:<port>.')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Up to this many extra seconds, chosen at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+    parser.add_argument('--size', type=int, default=10, help='Subagencies, components and breakdown rows per year')
+    parser.add_argument('--latest', type=int, default=2022, help='Latest fiscal year with published data')
+    args = parser.parse_args()
+
+    web.run_app(make_app(args.latency, args.jitter, args.error_rate, args.size, args.latest), host='127.0.0.1', port=args.port, access_log=None)